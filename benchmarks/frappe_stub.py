@@ -0,0 +1,215 @@
+"""A stand-in for the parts of frappe the benchmarked code touches, so it runs without a site.
+
+The database and cache keep nothing but what the benchmarks put in them, writes are counted
+and dropped. Call install() before importing any fingerprint module.
+"""
+import contextlib
+import datetime
+import secrets
+import sys
+import types
+
+
+class _dict(dict):
+    __getattr__ = dict.get
+    __setattr__ = dict.__setitem__
+
+
+class StubDB:
+    def __init__(self):
+        # {(doctype, name): {field: value}}
+        self.values = {}
+        self.written_rows = 0
+        self.commits = 0
+
+    def get_value(self, doctype, filters=None, fieldname="name", as_dict=False, **kwargs):
+        values = self.values.get((doctype, filters))
+        if values is None:
+            return None
+        if isinstance(fieldname, (list, tuple)):
+            return _dict({field: values.get(field) for field in fieldname}) if as_dict else tuple(values.get(field) for field in fieldname)
+        return values.get(fieldname)
+
+    def sql(self, query, values=None, as_dict=False, **kwargs):
+        return []
+
+    def sql_list(self, query, values=None, **kwargs):
+        return []
+
+    def bulk_insert(self, doctype, fields, values, **kwargs):
+        self.written_rows += len(values)
+
+    def bulk_update(self, doctype, doc_updates, **kwargs):
+        self.written_rows += len(doc_updates)
+
+    def commit(self):
+        self.commits += 1
+
+    def rollback(self):
+        pass
+
+
+class StubCache:
+    def __init__(self):
+        self.data = {}
+
+    def make_key(self, key):
+        return key
+
+    def get_value(self, key, generator=None, **kwargs):
+        if key not in self.data and generator:
+            self.data[key] = generator()
+        return self.data.get(key)
+
+    def set_value(self, key, value, **kwargs):
+        self.data[key] = value
+
+    def delete_value(self, key):
+        self.data.pop(key, None)
+
+    def delete_keys(self, prefix):
+        for key in [key for key in self.data if key.startswith(prefix)]:
+            del self.data[key]
+
+    def hget(self, name, key, generator=None, **kwargs):
+        values = self.data.setdefault(name, {})
+        if key not in values and generator:
+            values[key] = generator()
+        return values.get(key)
+
+    def hset(self, name, key, value, **kwargs):
+        self.data.setdefault(name, {})[key] = value
+
+    def hdel(self, name, key):
+        self.data.get(name, {}).pop(key, None)
+
+    def hgetall(self, name):
+        return dict(self.data.get(name, {}))
+
+    def pipeline(self):
+        return StubPipeline(self)
+
+
+class StubPipeline:
+    """Runs the raw hash commands fingerprint.api.metrics sends, values are kept as floats."""
+
+    def __init__(self, cache):
+        self.cache = cache
+        self.results = []
+
+    def hincrbyfloat(self, name, key, amount):
+        values = self.cache.data.setdefault(name, {})
+        values[key] = values.get(key, 0.0) + amount
+        self.results.append(values[key])
+
+    def hsetnx(self, name, key, value):
+        self.results.append(self.cache.data.setdefault(name, {}).setdefault(key, value))
+
+    def hgetall(self, name):
+        self.results.append({key.encode(): str(value).encode() for key, value in self.cache.data.get(name, {}).items()})
+
+    def expire(self, name, seconds):
+        self.results.append(True)
+
+    def execute(self):
+        results, self.results = self.results, []
+        return results
+
+
+def get_datetime(value=None):
+    if value is None:
+        return datetime.datetime.now()
+    if isinstance(value, datetime.datetime):
+        return value
+    if isinstance(value, datetime.date):
+        return datetime.datetime.combine(value, datetime.time())
+    return datetime.datetime.fromisoformat(str(value))
+
+
+def cint(value, default=0):
+    try:
+        return int(float(value))
+    except (TypeError, ValueError):
+        return default
+
+
+@contextlib.contextmanager
+def filelock(lock_name, is_global=False, timeout=None):
+    yield
+
+
+class Document(_dict):
+    pass
+
+
+def parse_naming_series(parts):
+    """The date parts of a naming series prefix filled in, like `HR-ATT-.YYYY.-` gives HR-ATT-2024-."""
+    today = datetime.date.today()
+    date_parts = {"YY": f"{today:%y}", "YYYY": f"{today:%Y}", "MM": f"{today:%m}", "DD": f"{today:%d}"}
+    return "".join(date_parts.get(part, part) for part in parts.split("."))
+
+
+def install():
+    """Registers the stub as `frappe` and returns it."""
+    frappe = types.ModuleType("frappe")
+    frappe._dict = _dict
+    frappe._ = lambda message: message
+    frappe.db = StubDB()
+    frappe.flags = _dict()
+    frappe.conf = _dict()
+    frappe.session = _dict(user="Administrator")
+    frappe.local = _dict()
+    _cache = StubCache()
+    frappe.cache = lambda: _cache
+    frappe.whitelist = lambda *args, **kwargs: (lambda fn: fn)
+    frappe.get_site_path = lambda *path: "/".join(("site",) + path)
+    frappe.generate_hash = lambda *args, length=10, **kwargs: secrets.token_hex(length // 2 + 1)[:length]
+    frappe.scrub = lambda text: text.replace(" ", "_").replace("-", "_").lower()
+    frappe.get_all = lambda *args, **kwargs: []
+    frappe.get_traceback = lambda *args, **kwargs: ""
+    frappe.log_error = lambda *args, **kwargs: None
+    frappe.msgprint = lambda *args, **kwargs: None
+    frappe.publish_realtime = lambda *args, **kwargs: None
+
+    def throw(message, *args, **kwargs):
+        raise Exception(message)
+
+    frappe.throw = throw
+
+    utils = types.ModuleType("frappe.utils")
+    utils.cint = cint
+    utils.cstr = lambda value: "" if value is None else str(value)
+    utils.flt = lambda value, precision=None: float(value or 0)
+    utils.add_to_date = lambda date, seconds=0, **kwargs: date + datetime.timedelta(seconds=seconds)
+    utils.get_datetime = get_datetime
+    utils.now_datetime = datetime.datetime.now
+    synchronization = types.ModuleType("frappe.utils.synchronization")
+    synchronization.filelock = filelock
+    utils.synchronization = synchronization
+    frappe.utils = utils
+
+    model = types.ModuleType("frappe.model")
+    document = types.ModuleType("frappe.model.document")
+    document.Document = Document
+    model.document = document
+    naming = types.ModuleType("frappe.model.naming")
+    naming.parse_naming_series = parse_naming_series
+    model.naming = naming
+    frappe.model = model
+
+    user = types.ModuleType("frappe.core.doctype.user.user")
+    user.timedelta = datetime.timedelta
+
+    sys.modules.update({
+        "frappe": frappe,
+        "frappe.utils": utils,
+        "frappe.utils.synchronization": synchronization,
+        "frappe.model": model,
+        "frappe.model.document": document,
+        "frappe.model.naming": naming,
+        "frappe.core": types.ModuleType("frappe.core"),
+        "frappe.core.doctype": types.ModuleType("frappe.core.doctype"),
+        "frappe.core.doctype.user": types.ModuleType("frappe.core.doctype.user"),
+        "frappe.core.doctype.user.user": user,
+    })
+    return frappe
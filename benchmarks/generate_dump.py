@@ -0,0 +1,144 @@
+"""Generates realistic dumps in the collector's `*_last_fetch_dump.bin` format.
+
+    python -m benchmarks.generate_dump --employees 500 --days 30 --devices 3 --output /tmp/dumps
+
+Each record is what pyzk's Attendance holds: uid, user_id, timestamp (epoch seconds as the
+collector writes them), status and punch. The same seed always gives the same dumps.
+--format json writes the dumps of older collectors instead.
+"""
+import argparse
+import datetime
+import json
+import os
+import random
+
+# fetch_checkins shifts the epoch by this much when reading a record
+DEVICE_UTC_OFFSET = datetime.timedelta(hours=3)
+
+
+def to_record_timestamp(local_time):
+    """Epoch value that get_record_datetime turns back into local_time."""
+    return (local_time - DEVICE_UTC_OFFSET).timestamp()
+
+
+def get_day_punches(rng, day, punches_per_day, overnight):
+    """Punch times of one employee on one day, IN first, OUT last and extra punches in between."""
+    if overnight:
+        # evening shift ending between midnight and 04:00
+        start = datetime.datetime.combine(day, datetime.time(20)) + datetime.timedelta(minutes=rng.gauss(0, 20))
+        end = datetime.datetime.combine(day + datetime.timedelta(days=1), datetime.time(2)) + datetime.timedelta(minutes=rng.gauss(0, 30))
+    else:
+        start = datetime.datetime.combine(day, datetime.time(8, 30)) + datetime.timedelta(minutes=rng.gauss(0, 20))
+        end = datetime.datetime.combine(day, datetime.time(15)) + datetime.timedelta(minutes=rng.gauss(0, 25))
+
+    count = max(1, round(rng.gauss(punches_per_day, 0.5)))
+    if count == 1:
+        return [start]
+    middle = sorted(
+        start + (end - start) * rng.random() for _ in range(count - 2)
+    )
+    return [start] + middle + [end]
+
+
+def generate_dumps(
+    employees=200,
+    days=30,
+    punches_per_day=2,
+    overnight_ratio=0.05,
+    devices=2,
+    absence_ratio=0.05,
+    start_date=datetime.date(2025, 1, 1),
+    seed=0,
+):
+    """Returns {device number: records ordered by time} for `employees` spread over `devices`.
+
+    Every employee punches on one device, a tenth of them also on a second one. Employees
+    on the overnight shift punch out after midnight.
+    """
+    rng = random.Random(seed)
+    records = {device: [] for device in range(1, devices + 1)}
+    for employee in range(1, employees + 1):
+        user_id = str(employee)
+        overnight = rng.random() < overnight_ratio
+        home_device = rng.randint(1, devices)
+        other_device = rng.randint(1, devices) if rng.random() < 0.1 else home_device
+        for offset in range(days):
+            day = start_date + datetime.timedelta(days=offset)
+            if rng.random() < absence_ratio:
+                continue
+            for punch_time in get_day_punches(rng, day, punches_per_day, overnight):
+                device = other_device if rng.random() < 0.5 else home_device
+                records[device].append({
+                    "uid": employee,
+                    "user_id": user_id,
+                    "timestamp": to_record_timestamp(punch_time.replace(microsecond=0)),
+                    "status": 1,
+                    "punch": 0,
+                })
+
+    for device_records in records.values():
+        device_records.sort(key=lambda record: record["timestamp"])
+    return records
+
+
+def write_dump(path, records, format="bin"):
+    if format == "json":
+        with open(path, "w") as f:
+            json.dump(records, f)
+        return
+
+    from fingerprint.api.dump_format import write_binary_dump
+    from fingerprint.api.punch import Punch
+
+    with open(path, "wb") as f:
+        write_binary_dump(f, [Punch.from_dict(record) for record in records])
+
+
+def write_dumps(directory, company="Benchmark Company", format="bin", **kwargs):
+    """Writes one dump per device named like the collector does and returns their paths."""
+    os.makedirs(directory, exist_ok=True)
+    paths = []
+    for device, device_records in generate_dumps(**kwargs).items():
+        path = os.path.join(directory, f"{company}_{device}_10.0.0.{device}_last_fetch_dump.{format}")
+        write_dump(path, device_records, format)
+        paths.append(path)
+    return paths
+
+
+def add_dump_arguments(parser):
+    """Adds the options of generate_dumps, shared with benchmarks.run."""
+    parser.add_argument("--employees", type=int, default=200)
+    parser.add_argument("--days", type=int, default=30)
+    parser.add_argument("--punches-per-day", type=float, default=2)
+    parser.add_argument("--overnight-ratio", type=float, default=0.05)
+    parser.add_argument("--devices", type=int, default=2)
+    parser.add_argument("--seed", type=int, default=0)
+    return parser
+
+
+def get_parser():
+    return add_dump_arguments(argparse.ArgumentParser(description=__doc__.splitlines()[0]))
+
+
+def main():
+    parser = get_parser()
+    parser.add_argument("--company", default="Benchmark Company")
+    parser.add_argument("--output", required=True)
+    parser.add_argument("--format", choices=("bin", "json"), default="bin")
+    args = parser.parse_args()
+    for path in write_dumps(
+        args.output,
+        company=args.company,
+        format=args.format,
+        employees=args.employees,
+        days=args.days,
+        punches_per_day=args.punches_per_day,
+        overnight_ratio=args.overnight_ratio,
+        devices=args.devices,
+        seed=args.seed,
+    ):
+        print(path)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,309 @@
+"""Times and measures the memory of the import and attendance hot paths on a synthetic dump.
+
+    python -m benchmarks.run --employees 500 --days 30 --save baseline.json
+    python -m benchmarks.run --employees 500 --days 30 --compare baseline.json
+
+Runs against benchmarks.frappe_stub, no site is needed. With --compare the run exits with
+status 1 when a benchmark got slower or uses more memory than --threshold times the baseline.
+"""
+import argparse
+import datetime
+import gc
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+from collections import defaultdict
+
+REPO_PATH = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_PATH)
+
+from benchmarks import frappe_stub
+from benchmarks.generate_dump import add_dump_arguments, generate_dumps
+
+
+def measure(func, setup, repeat):
+    """Returns (timings in seconds, peak traced memory in bytes), setup is not measured."""
+    timings = []
+    for _ in range(repeat):
+        args = setup()
+        gc.collect()
+        start = time.perf_counter()
+        func(*args)
+        timings.append(time.perf_counter() - start)
+
+    args = setup()
+    gc.collect()
+    tracemalloc.start()
+    func(*args)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return timings, peak
+
+
+def calculate_early_exit_and_late_entry(employee, sorted_logs, writer):
+    """The per-log loop compute_attendance replaced, kept as its baseline: one Employee lookup
+    per call and a fixed 08:30 to 15:00 shift."""
+    import frappe
+
+    checkin_time = None
+    employee_name = frappe.db.get_value("Employee", employee, "employee_name")
+
+    for log in sorted_logs:
+        if log.log_type == "IN" and checkin_time is None:
+            checkin_time = log.time
+            work_start = datetime.datetime.combine(checkin_time.date(), datetime.time(8, 30))
+            delay_enter = max((checkin_time - work_start).total_seconds() / 60, 0)
+            writer.add({
+                "employee": employee,
+                "employee_name": employee_name,
+                "attendance_date": checkin_time.date(),
+                "in_time": checkin_time.time(),
+                "out_time": None,
+                "working_hours": None,
+                "custom_late_entry_in_minutes": round(delay_enter, 1),
+                "custom_early_exit_in_minutes": None,
+            })
+        elif log.log_type == "OUT":
+            checkout_time = log.time
+            if checkin_time and checkout_time > checkin_time:
+                work_start = datetime.datetime.combine(checkin_time.date(), datetime.time(8, 30))
+                work_end = datetime.datetime.combine(checkin_time.date(), datetime.time(15, 0))
+                working_hours = round((checkout_time - checkin_time).total_seconds() / 3600, 2)
+                delay_enter = max((checkin_time - work_start).total_seconds() / 60, 0)
+                early_exit = max((work_end - checkout_time).total_seconds() / 60, 0)
+
+                writer.add({
+                    "employee": employee,
+                    "employee_name": employee_name,
+                    "attendance_date": checkin_time.date(),
+                    "in_time": checkin_time.time(),
+                    "out_time": checkout_time.time(),
+                    "working_hours": working_hours,
+                    "custom_late_entry_in_minutes": round(delay_enter, 1),
+                    "custom_early_exit_in_minutes": round(early_exit, 1),
+                })
+
+                checkin_time = None
+            elif not checkin_time:
+                # No IN before OUT — save only checkout
+                work_end = datetime.datetime.combine(checkout_time.date(), datetime.time(15, 0))
+                early_exit = max((work_end - checkout_time).total_seconds() / 60, 0)
+                writer.add({
+                    "employee": employee,
+                    "employee_name": employee_name,
+                    "attendance_date": checkout_time.date(),
+                    "in_time": None,
+                    "out_time": checkout_time.time(),
+                    "working_hours": None,
+                    "custom_late_entry_in_minutes": None,
+                    "custom_early_exit_in_minutes": round(early_exit, 1),
+                })
+    if checkin_time:
+        # Final unmatched IN
+        work_start = datetime.datetime.combine(checkin_time.date(), datetime.time(8, 30))
+        delay_enter = max((checkin_time - work_start).total_seconds() / 60, 0)
+        writer.add({
+            "employee": employee,
+            "employee_name": employee_name,
+            "attendance_date": checkin_time.date(),
+            "in_time": checkin_time.time(),
+            "out_time": None,
+            "working_hours": None,
+            "custom_late_entry_in_minutes": round(delay_enter, 1),
+            "custom_early_exit_in_minutes": None,
+        })
+
+
+def get_benchmarks(records):
+    """{name: (func, setup)} for every benchmarked function, on the records of all devices."""
+    from fingerprint.api.attendance_engine import DEFAULT_SHIFT_END, DEFAULT_SHIFT_START, compute_attendance
+    from fingerprint.api.fetch_checkins import (
+        add_punch_direction,
+        edit_attendance,
+        get_record_datetime,
+        get_shift_date,
+        read_dump,
+        read_dump_window,
+        select_window,
+    )
+    from fingerprint.api.mark_attendance import AttendanceWriter
+    from benchmarks.generate_dump import write_dump
+    import frappe
+    import numpy as np
+
+    edited = [edit_attendance(record.copy()) for record in records]
+    first, last = edited[0].timestamp, edited[-1].timestamp
+    # the middle half of the dump, so both window bounds fall inside it
+    window_start = first + (last - first) / 4
+    window_end = last - (last - first) / 4
+    # in the working directory, main runs in a temporary one
+    for format in ("json", "bin"):
+        write_dump(f"dump.{format}", [record.as_dict() for record in records], format)
+
+    checkins = [
+        frappe_stub._dict(
+            employee=f"HR-EMP-{log.user_id}",
+            employee_name=f"Employee {log.user_id}",
+            time=log.timestamp,
+            log_type=log.log_type,
+        )
+        for log in add_punch_direction([record.copy() for record in edited])
+        if log.log_type != "OTHER"
+    ]
+    by_employee = defaultdict(list)
+    for checkin in checkins:
+        by_employee[checkin.employee].append(checkin)
+    for employee in by_employee:
+        frappe.db.values[("Employee", employee)] = {"employee_name": f"Employee {employee}"}
+    # everyone on the default shift, compute_attendance would otherwise look shifts up
+    shift_timings = (
+        np.full(len(by_employee), DEFAULT_SHIFT_START),
+        np.full(len(by_employee), DEFAULT_SHIFT_END),
+        np.empty((0, 5), dtype=np.int64),
+    )
+
+    def calculate_all(employee_checkins):
+        writer = AttendanceWriter()
+        for employee, logs in employee_checkins.items():
+            # per day and IN first, as add_absence_to_attendances used to call it
+            days = defaultdict(list)
+            for log in logs:
+                days[log.time.date()].append(log)
+            for day_logs in days.values():
+                calculate_early_exit_and_late_entry(
+                    employee, sorted(day_logs, key=lambda x: 0 if x["log_type"] == "IN" else 1), writer
+                )
+        writer.flush()
+
+    def compute_all(checkins):
+        writer = AttendanceWriter()
+        for row in compute_attendance(checkins, shift_timings):
+            writer.add(row)
+        writer.flush()
+
+    return {
+        "read_dump_json": (
+            read_dump,
+            lambda: ("dump.json",),
+        ),
+        "read_dump_bin": (
+            read_dump,
+            lambda: ("dump.bin",),
+        ),
+        "read_dump_window": (
+            read_dump_window,
+            lambda: ("dump.bin", window_start, window_end),
+        ),
+        "edit_attendance": (
+            lambda logs: [edit_attendance(log) for log in logs],
+            lambda: ([record.copy() for record in records],),
+        ),
+        "get_record_datetime": (
+            lambda logs: [get_record_datetime(log) for log in logs],
+            lambda: (records,),
+        ),
+        "get_shift_date": (
+            lambda logs: [get_shift_date(log) for log in logs],
+            lambda: ([log.copy() for log in edited],),
+        ),
+        "add_punch_direction": (
+            add_punch_direction,
+            lambda: ([log.copy() for log in edited],),
+        ),
+        "select_window": (
+            select_window,
+            lambda: ([record.copy() for record in records], window_start, window_end),
+        ),
+        "calculate_early_exit_and_late_entry": (
+            calculate_all,
+            lambda: (by_employee,),
+        ),
+        "compute_attendance": (
+            compute_all,
+            lambda: (checkins,),
+        ),
+    }
+
+
+def run(args):
+    dumps = generate_dumps(
+        employees=args.employees,
+        days=args.days,
+        punches_per_day=args.punches_per_day,
+        overnight_ratio=args.overnight_ratio,
+        devices=args.devices,
+        seed=args.seed,
+    )
+    from fingerprint.api.punch import Punch
+
+    records = sorted(
+        (Punch.from_dict(record) for device_records in dumps.values() for record in device_records),
+        key=lambda record: record.timestamp,
+    )
+
+    results = {}
+    for name, (func, setup) in get_benchmarks(records).items():
+        if args.only and name not in args.only:
+            continue
+        timings, peak = measure(func, setup, args.repeat)
+        results[name] = {
+            "records": len(records),
+            "min": min(timings),
+            "median": statistics.median(timings),
+            "peak_memory": peak,
+        }
+        print(
+            f"{name:<40} {len(records):>9} records"
+            f"  min {min(timings) * 1000:>9.1f} ms  median {statistics.median(timings) * 1000:>9.1f} ms"
+            f"  peak {peak / 1024 / 1024:>8.1f} MiB"
+        )
+    return results
+
+
+def compare(results, baseline, threshold):
+    """Prints the benchmarks slower or bigger than threshold times the baseline, returns their count."""
+    regressions = 0
+    for name, result in results.items():
+        if name not in baseline:
+            continue
+        # min is the least noisy timing of a run
+        for metric in ("min", "peak_memory"):
+            if baseline[name][metric] and result[metric] > baseline[name][metric] * threshold:
+                regressions += 1
+                print(f"REGRESSION {name} {metric}: {baseline[name][metric]:.4g} -> {result[metric]:.4g}")
+    return regressions
+
+
+def main():
+    parser = add_dump_arguments(argparse.ArgumentParser(description=__doc__.splitlines()[0]))
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--only", nargs="*", help="names of the benchmarks to run")
+    parser.add_argument("--save", help="write the results to this json file")
+    parser.add_argument("--compare", help="json file of an earlier run to compare with")
+    parser.add_argument("--threshold", type=float, default=1.25)
+    args = parser.parse_args()
+
+    save = os.path.abspath(args.save) if args.save else None
+    baseline_path = os.path.abspath(args.compare) if args.compare else None
+    frappe_stub.install()
+    # the app writes its logs and status files relative to the working directory
+    os.chdir(tempfile.mkdtemp(prefix="fingerprint_benchmarks_"))
+    print(f"python {sys.version.split()[0]}, {datetime.datetime.now():%Y-%m-%d %H:%M}")
+    results = run(args)
+
+    if save:
+        with open(save, "w") as f:
+            json.dump(results, f, indent=1)
+    if baseline_path:
+        with open(baseline_path) as f:
+            baseline = json.load(f)
+        if compare(results, baseline, args.threshold):
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+"""Pulls many simulated devices at once, the way the collector does, and reports how it went.
+
+    python -m benchmarks.zk_load --devices 24 --records 20000 --workers 8 --timeout 5 --loss 0.01
+
+Starts the devices with benchmarks.zk_simulator in this process, then every device is pulled
+with pyzk in a thread pool: connect, disable, get_attendance, get_serialnumber, enable and
+disconnect, as get_all_attendance_from_device does.
+"""
+import argparse
+import statistics
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from zk import ZK
+
+from benchmarks.zk_simulator import add_device_arguments, start_devices
+
+
+def pull(ip, port, timeout):
+    """Returns (records, seconds), pyzk errors are raised."""
+    start = time.perf_counter()
+    conn = ZK(ip, port=port, timeout=timeout, ommit_ping=True).connect()
+    try:
+        conn.disable_device()
+        attendances = conn.get_attendance()
+        conn.get_serialnumber()
+        conn.enable_device()
+    finally:
+        try:
+            conn.disconnect()
+        except Exception:
+            pass
+    return len(attendances), time.perf_counter() - start
+
+
+def pull_all(ips, port=4370, workers=8, timeout=30):
+    """Returns {ip: (records, seconds) or the exception it failed with} and the total seconds."""
+    results = {}
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {executor.submit(pull, ip, port, timeout): ip for ip in ips}
+        for future in as_completed(futures):
+            try:
+                results[futures[future]] = future.result()
+            except Exception as e:
+                results[futures[future]] = e
+    return results, time.perf_counter() - start
+
+
+def main():
+    parser = add_device_arguments(argparse.ArgumentParser(description=__doc__.splitlines()[0]))
+    parser.add_argument("--workers", type=int, default=8)
+    parser.add_argument("--timeout", type=float, default=30)
+    args = parser.parse_args()
+
+    servers, stopped = start_devices(
+        args.devices,
+        first_ip=args.first_ip,
+        port=args.port,
+        users=args.users,
+        records=args.records,
+        latency=args.latency,
+        jitter=args.jitter,
+        loss=args.loss,
+        hang_after=args.hang_after,
+        hang_on=args.hang_on,
+        new_records_per_connect=args.new_records_per_connect,
+        password=args.password,
+        seed=args.seed,
+    )
+    try:
+        results, elapsed = pull_all(
+            [server.server_address[0] for server in servers], args.port, args.workers, args.timeout
+        )
+    finally:
+        stopped.set()
+        for server in servers:
+            server.shutdown()
+
+    pulled = {ip: result for ip, result in results.items() if not isinstance(result, Exception)}
+    for ip, result in sorted(results.items()):
+        if isinstance(result, Exception):
+            print(f"{ip:<15} failed   {type(result).__name__}: {result}")
+        else:
+            print(f"{ip:<15} {result[0]:>8} records  {result[1]:>7.2f} s")
+    durations = [seconds for records, seconds in pulled.values()]
+    print(
+        f"{len(pulled)}/{len(results)} devices pulled in {elapsed:.2f} s"
+        + (f", per device median {statistics.median(durations):.2f} s max {max(durations):.2f} s" if durations else "")
+    )
+
+
+if __name__ == "__main__":
+    main()
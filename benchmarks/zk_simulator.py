@@ -0,0 +1,357 @@
+"""Simulated ZKTeco devices speaking the part of the ZK TCP protocol pyzk uses.
+
+    python -m benchmarks.zk_simulator --devices 24 --records 20000 --latency 0.02 --loss 0.01
+
+Each device listens on its own loopback address (127.0.1.1, 127.0.1.2, ...) on port 4370 like
+a real one, so the collector can be pointed at them with IPs = "127.0.1.1,127.0.1.2,...".
+Supported: connect and auth, enable/disable device, free sizes, options (serial number),
+users and attendance through buffered reads, free data and exit.
+
+Faults: --latency / --jitter delay every response, --loss drops a response (the client times
+out waiting for it), --hang-after stops answering after that many commands and --hang-on
+stops answering a given command. --new-records-per-connect appends punches on every
+connection, for trying delta pulls.
+"""
+import argparse
+import datetime
+import ipaddress
+import random
+import socketserver
+import threading
+from struct import pack, unpack
+
+from benchmarks.generate_dump import get_day_punches
+
+USHRT_MAX = 65535
+MACHINE_PREPARE_DATA_1 = 20560
+MACHINE_PREPARE_DATA_2 = 32130
+
+CMD_USERTEMP_RRQ = 9
+CMD_OPTIONS_RRQ = 11
+CMD_ATTLOG_RRQ = 13
+CMD_GET_FREE_SIZES = 50
+CMD_CONNECT = 1000
+CMD_EXIT = 1001
+CMD_ENABLEDEVICE = 1002
+CMD_DISABLEDEVICE = 1003
+CMD_GET_VERSION = 1100
+CMD_AUTH = 1102
+CMD_PREPARE_DATA = 1500
+CMD_DATA = 1501
+CMD_FREE_DATA = 1502
+CMD_PREPARE_BUFFER = 1503
+CMD_READ_BUFFER = 1504
+CMD_ACK_OK = 2000
+CMD_ACK_ERROR = 2001
+CMD_ACK_UNAUTH = 2005
+CMD_ACK_UNKNOWN = 0xFFFF
+
+COMMAND_NAMES = {
+    "connect": CMD_CONNECT,
+    "auth": CMD_AUTH,
+    "exit": CMD_EXIT,
+    "enable": CMD_ENABLEDEVICE,
+    "disable": CMD_DISABLEDEVICE,
+    "sizes": CMD_GET_FREE_SIZES,
+    "options": CMD_OPTIONS_RRQ,
+    "prepare": CMD_PREPARE_BUFFER,
+    "read": CMD_READ_BUFFER,
+    "free": CMD_FREE_DATA,
+}
+
+
+def create_checksum(packet):
+    """Checksum of a header and its data, as zkemsdk.c computes it."""
+    if len(packet) % 2:
+        packet += b"\x00"
+    checksum = 0
+    for (word,) in (unpack("<H", packet[i:i + 2]) for i in range(0, len(packet), 2)):
+        checksum += word
+        if checksum > USHRT_MAX:
+            checksum -= USHRT_MAX
+    checksum = ~checksum
+    while checksum < 0:
+        checksum += USHRT_MAX
+    return checksum
+
+
+def make_packet(command, session_id, reply_id, data=b""):
+    checksum = create_checksum(pack("<4H", command, 0, session_id, reply_id) + data)
+    packet = pack("<4H", command, checksum, session_id, reply_id) + data
+    return pack("<HHI", MACHINE_PREPARE_DATA_1, MACHINE_PREPARE_DATA_2, len(packet)) + packet
+
+
+def make_commkey(key, session_id, ticks=50):
+    """The scrambled password a client sends with CMD_AUTH, see pyzk's make_commkey."""
+    k = 0
+    for i in range(32):
+        k = (k << 1 | 1) if int(key) & (1 << i) else k << 1
+    k += int(session_id)
+    k = unpack("BBBB", pack("I", k))
+    k = unpack("HH", pack("BBBB", k[0] ^ ord("Z"), k[1] ^ ord("K"), k[2] ^ ord("S"), k[3] ^ ord("O")))
+    k = unpack("BBBB", pack("HH", k[1], k[0]))
+    b = 0xFF & ticks
+    return pack("BBBB", k[0] ^ b, k[1] ^ b, b, k[3] ^ b)
+
+
+def encode_time(t):
+    """Device timestamp encoding, the inverse of pyzk's __decode_time."""
+    return (
+        ((t.year % 100) * 12 * 31 + ((t.month - 1) * 31) + t.day - 1) * (24 * 60 * 60)
+        + (t.hour * 60 + t.minute) * 60
+        + t.second
+    )
+
+
+class SimulatedDevice:
+    """The users and punch log of one device, and how badly it behaves on the network."""
+
+    def __init__(
+        self,
+        serial,
+        users=100,
+        records=1000,
+        start_date=datetime.date(2025, 1, 1),
+        latency=0.0,
+        jitter=0.0,
+        loss=0.0,
+        hang_after=0,
+        hang_on=(),
+        new_records_per_connect=0,
+        password=0,
+        seed=0,
+    ):
+        self.serial = serial
+        self.users = [str(user_id) for user_id in range(1, users + 1)]
+        self.latency = latency
+        self.jitter = jitter
+        self.loss = loss
+        self.hang_after = hang_after
+        self.hang_on = {COMMAND_NAMES[name] for name in hang_on}
+        self.new_records_per_connect = new_records_per_connect
+        self.password = password
+        self.rng = random.Random(seed)
+        self.lock = threading.Lock()
+        # [(uid, user_id, local time)] in punch order
+        self.attendances = []
+        self.next_day = start_date
+        self.add_records(records)
+
+    def add_records(self, count):
+        """Appends `count` punches, a day of every user at a time."""
+        with self.lock:
+            target = len(self.attendances) + count
+            while len(self.attendances) < target:
+                day = []
+                for uid, user_id in enumerate(self.users, 1):
+                    day.extend(
+                        (uid, user_id, punch.replace(microsecond=0))
+                        for punch in get_day_punches(self.rng, self.next_day, 2, False)
+                    )
+                day.sort(key=lambda attendance: attendance[2])
+                self.attendances.extend(day[:target - len(self.attendances)])
+                self.next_day += datetime.timedelta(days=1)
+
+    def get_sizes(self):
+        fields = [0] * 20
+        fields[4] = len(self.users)
+        fields[8] = len(self.attendances)
+        fields[14], fields[15], fields[16] = 3000, 10000, 100000
+        fields[17] = fields[14]
+        fields[18] = fields[15] - len(self.users)
+        fields[19] = fields[16] - len(self.attendances)
+        return pack("20i", *fields) + pack("3i", 0, 0, 0)
+
+    def get_users_buffer(self):
+        body = b"".join(
+            pack("<HB8s24sIx7sx24s", uid, 0, b"", f"User {user_id}".encode(), 0, b"1", user_id.encode())
+            for uid, user_id in enumerate(self.users, 1)
+        )
+        return pack("I", len(body)) + body
+
+    def get_attendance_buffer(self):
+        with self.lock:
+            body = b"".join(
+                pack("<H24sB4sB8s", uid, user_id.encode(), 1, pack("<I", encode_time(punch_time)), 0, b"")
+                for uid, user_id, punch_time in self.attendances
+            )
+        return pack("I", len(body)) + body
+
+
+class DeviceHandler(socketserver.BaseRequestHandler):
+    """One client connection, commands are answered in the order they arrive."""
+
+    def setup(self):
+        self.device = self.server.device
+        self.session_id = self.device.rng.randint(1, USHRT_MAX - 1)
+        self.authenticated = False
+        self.buffer = b""
+        self.commands = 0
+
+    def recv_exact(self, size):
+        data = b""
+        while len(data) < size:
+            received = self.request.recv(size - len(data))
+            if not received:
+                raise ConnectionError("client closed the connection")
+            data += received
+        return data
+
+    def handle(self):
+        try:
+            while True:
+                magic_1, magic_2, length = unpack("<HHI", self.recv_exact(8))
+                if (magic_1, magic_2) != (MACHINE_PREPARE_DATA_1, MACHINE_PREPARE_DATA_2):
+                    return
+                packet = self.recv_exact(length)
+                command, checksum, session_id, reply_id = unpack("<4H", packet[:8])
+                response = self.respond(command, packet[8:], reply_id)
+                if not self.misbehave(command):
+                    self.request.sendall(response)
+                if command == CMD_EXIT:
+                    return
+        except (ConnectionError, OSError):
+            return
+
+    def misbehave(self, command):
+        """Applies the device's faults to a response, True when it must not be sent."""
+        device = self.device
+        self.commands += 1
+        if command in device.hang_on or (device.hang_after and self.commands > device.hang_after):
+            # keeps the connection open without ever answering, until the simulator stops
+            self.server.stopped.wait()
+            return True
+        if device.latency or device.jitter:
+            self.server.stopped.wait(device.latency + device.rng.uniform(0, device.jitter))
+        return device.rng.random() < device.loss
+
+    def reply(self, command, reply_id, data=b""):
+        return make_packet(command, self.session_id, reply_id, data)
+
+    def respond(self, command, data, reply_id):
+        device = self.device
+        if command == CMD_CONNECT:
+            if device.new_records_per_connect:
+                device.add_records(device.new_records_per_connect)
+            self.authenticated = not device.password
+            return self.reply(CMD_ACK_OK if self.authenticated else CMD_ACK_UNAUTH, reply_id)
+        if command == CMD_AUTH:
+            self.authenticated = data[:4] == make_commkey(device.password, self.session_id)
+            return self.reply(CMD_ACK_OK if self.authenticated else CMD_ACK_UNAUTH, reply_id)
+        if not self.authenticated:
+            return self.reply(CMD_ACK_UNAUTH, reply_id)
+
+        if command in (CMD_EXIT, CMD_ENABLEDEVICE, CMD_DISABLEDEVICE):
+            return self.reply(CMD_ACK_OK, reply_id)
+        if command == CMD_GET_VERSION:
+            return self.reply(CMD_ACK_OK, reply_id, b"Ver 6.60 Sim\x00")
+        if command == CMD_GET_FREE_SIZES:
+            return self.reply(CMD_ACK_OK, reply_id, device.get_sizes())
+        if command == CMD_OPTIONS_RRQ:
+            option = data.split(b"\x00")[0]
+            values = {b"~SerialNumber": device.serial.encode(), b"~Platform": b"ZMM220_TFT", b"~DeviceName": b"Simulator"}
+            if option not in values:
+                return self.reply(CMD_ACK_ERROR, reply_id)
+            return self.reply(CMD_ACK_OK, reply_id, option + b"=" + values[option] + b"\x00")
+        if command == CMD_PREPARE_BUFFER:
+            buffered_command = unpack("<bhii", data[:11])[1]
+            if buffered_command == CMD_USERTEMP_RRQ:
+                self.buffer = device.get_users_buffer()
+            elif buffered_command == CMD_ATTLOG_RRQ:
+                self.buffer = device.get_attendance_buffer()
+            else:
+                return self.reply(CMD_ACK_ERROR, reply_id)
+            return self.reply(CMD_ACK_OK, reply_id, b"\x00" + pack("<I", len(self.buffer)) + b"\x00" * 4)
+        if command == CMD_READ_BUFFER:
+            start, size = unpack("<ii", data[:8])
+            chunk = self.buffer[start:start + size]
+            # announce the size, send the data, then confirm, in one write
+            return (
+                self.reply(CMD_PREPARE_DATA, reply_id, pack("<II", len(chunk), 0))
+                + self.reply(CMD_DATA, reply_id, chunk)
+                + self.reply(CMD_ACK_OK, reply_id)
+            )
+        if command == CMD_FREE_DATA:
+            self.buffer = b""
+            return self.reply(CMD_ACK_OK, reply_id)
+        return self.reply(CMD_ACK_UNKNOWN, reply_id)
+
+
+class DeviceServer(socketserver.ThreadingTCPServer):
+    allow_reuse_address = True
+    daemon_threads = True
+
+    def __init__(self, address, device, stopped):
+        self.device = device
+        self.stopped = stopped
+        super().__init__(address, DeviceHandler)
+
+
+def start_devices(count, first_ip="127.0.1.1", port=4370, stopped=None, **device_options):
+    """Starts `count` simulated devices on consecutive addresses and returns their servers.
+
+    Set the returned event, or `stopped` when given, to release hanging connections
+    before calling shutdown() on the servers.
+    """
+    stopped = stopped or threading.Event()
+    seed = device_options.pop("seed", 0)
+    servers = []
+    for i in range(count):
+        ip = str(ipaddress.ip_address(first_ip) + i)
+        device = SimulatedDevice(serial=f"SIM{seed:04d}{i + 1:04d}", seed=seed + i, **device_options)
+        server = DeviceServer((ip, port), device, stopped)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        servers.append(server)
+    return servers, stopped
+
+
+def add_device_arguments(parser):
+    """Adds the options of start_devices, shared with benchmarks.zk_load."""
+    parser.add_argument("--devices", type=int, default=4)
+    parser.add_argument("--first-ip", default="127.0.1.1")
+    parser.add_argument("--port", type=int, default=4370)
+    parser.add_argument("--users", type=int, default=100)
+    parser.add_argument("--records", type=int, default=1000)
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds added to every response")
+    parser.add_argument("--jitter", type=float, default=0.0, help="up to this many more seconds, at random")
+    parser.add_argument("--loss", type=float, default=0.0, help="probability of dropping a response")
+    parser.add_argument("--hang-after", type=int, default=0, help="stop answering after this many commands")
+    parser.add_argument("--hang-on", nargs="*", default=(), choices=sorted(COMMAND_NAMES))
+    parser.add_argument("--new-records-per-connect", type=int, default=0)
+    parser.add_argument("--password", type=int, default=0)
+    parser.add_argument("--seed", type=int, default=0)
+    return parser
+
+
+def get_parser():
+    return add_device_arguments(argparse.ArgumentParser(description=__doc__.splitlines()[0]))
+
+
+def main():
+    args = get_parser().parse_args()
+    servers, stopped = start_devices(
+        args.devices,
+        first_ip=args.first_ip,
+        port=args.port,
+        users=args.users,
+        records=args.records,
+        latency=args.latency,
+        jitter=args.jitter,
+        loss=args.loss,
+        hang_after=args.hang_after,
+        hang_on=args.hang_on,
+        new_records_per_connect=args.new_records_per_connect,
+        password=args.password,
+        seed=args.seed,
+    )
+    print("IPs =", ",".join(server.server_address[0] for server in servers))
+    try:
+        stopped.wait()
+    except KeyboardInterrupt:
+        stopped.set()
+        for server in servers:
+            server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
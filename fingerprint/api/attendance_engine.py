@@ -0,0 +1,150 @@
+import frappe
+import datetime
+import numpy as np
+
+SECONDS_PER_DAY = 24 * 60 * 60
+# used for employees without a Shift Assignment or default shift
+DEFAULT_SHIFT_START = 8 * 3600 + 30 * 60
+DEFAULT_SHIFT_END = 15 * 3600
+IN, OUT, OTHER = 0, 1, 2
+LOG_TYPES = {"IN": IN, "OUT": OUT}
+EPOCH = datetime.datetime(1970, 1, 1)
+
+
+def to_seconds(value):
+    """Seconds of a Time field value, which the database returns as a timedelta."""
+    if value is None:
+        return None
+    if isinstance(value, datetime.timedelta):
+        return int(value.total_seconds())
+    return value.hour * 3600 + value.minute * 60 + value.second
+
+
+def get_shift_timings(employees, start_date, end_date):
+    """Returns the shift start and end of employees, in seconds of the day.
+
+    (default start, default end) come from each employee's default shift and the
+    assignments (employee index, from day, to day, start, end) from the Shift Assignments
+    active between start_date and end_date, days counted from the epoch.
+    """
+    employee_index = {employee: i for i, employee in enumerate(employees)}
+    shift_types = {
+        shift.name: (to_seconds(shift.start_time), to_seconds(shift.end_time))
+        for shift in frappe.get_all("Shift Type", fields=["name", "start_time", "end_time"])
+    }
+
+    default_start = np.full(len(employees), DEFAULT_SHIFT_START, dtype=np.int64)
+    default_end = np.full(len(employees), DEFAULT_SHIFT_END, dtype=np.int64)
+    for employee, default_shift in frappe.get_all(
+        "Employee", filters={"name": ["in", employees]}, fields=["name", "default_shift"], as_list=True
+    ):
+        if shift_types.get(default_shift, (None,))[0] is not None:
+            default_start[employee_index[employee]], default_end[employee_index[employee]] = shift_types[default_shift]
+
+    assignments = []
+    for assignment in frappe.get_all(
+        "Shift Assignment",
+        filters={
+            "employee": ["in", employees],
+            "docstatus": 1,
+            "status": "Active",
+            "start_date": ["<=", end_date],
+        },
+        or_filters=[["end_date", "is", "not set"], ["end_date", ">=", start_date]],
+        fields=["employee", "shift_type", "start_date", "end_date"],
+    ):
+        start, end = shift_types.get(assignment.shift_type, (None, None))
+        if start is None or end is None:
+            continue
+        assignments.append((
+            employee_index[assignment.employee],
+            (assignment.start_date - EPOCH.date()).days,
+            (assignment.end_date - EPOCH.date()).days if assignment.end_date else np.iinfo(np.int32).max,
+            start,
+            end,
+        ))
+    return default_start, default_end, np.array(assignments, dtype=np.int64).reshape(-1, 5)
+
+
+def compute_attendance(checkins, shift_timings=None):
+    """Computes the attendance of every (employee, day) of `checkins` with array operations.
+
+    `checkins` are rows with employee, employee_name, time and log_type. Per employee and day,
+    in_time is the first IN, out_time the last OUT after it (or the last OUT of a day without
+    IN), and late entry / early exit are measured against the employee's shift of that day,
+    taken from Shift Assignment, then the employee's default shift, then 08:30 to 15:00.
+
+    Returns rows ready for AttendanceWriter.add.
+    """
+    if not len(checkins):
+        return []
+
+    employees, employee_idx = np.unique([log.employee for log in checkins], return_inverse=True)
+    employees = employees.tolist()
+    names = {log.employee: log.employee_name for log in checkins}
+    seconds = np.array(
+        [(log.time - EPOCH).total_seconds() for log in checkins], dtype=np.float64
+    ).astype(np.int64)
+    log_type = np.array([LOG_TYPES.get(log.log_type, OTHER) for log in checkins], dtype=np.int8)
+    day = seconds // SECONDS_PER_DAY
+
+    # one contiguous run per (employee, day), ordered by time inside it
+    order = np.lexsort((seconds, day, employee_idx))
+    employee_idx, day, seconds, log_type = employee_idx[order], day[order], seconds[order], log_type[order]
+    group_key = employee_idx.astype(np.int64) * (1 << 32) + day
+    group_start = np.flatnonzero(np.r_[True, group_key[1:] != group_key[:-1]])
+    group_of_log = np.cumsum(np.r_[False, group_key[1:] != group_key[:-1]])
+    group_employee = employee_idx[group_start]
+    group_day = day[group_start]
+
+    inf = np.iinfo(np.int64).max
+    first_in = np.minimum.reduceat(np.where(log_type == IN, seconds, inf), group_start)
+    has_in = first_in != inf
+    out_after = np.where(has_in, first_in, -inf)[group_of_log]
+    last_out = np.maximum.reduceat(np.where((log_type == OUT) & (seconds > out_after), seconds, -inf), group_start)
+    has_out = last_out != -inf
+
+    if shift_timings is None:
+        shift_timings = get_shift_timings(
+            employees,
+            (EPOCH + datetime.timedelta(days=int(group_day.min()))).date(),
+            (EPOCH + datetime.timedelta(days=int(group_day.max()))).date(),
+        )
+    default_start, default_end, assignments = shift_timings
+    shift_start = default_start[group_employee]
+    shift_end = default_end[group_employee]
+    if len(assignments):
+        # latest assignment of the employee starting on or before the day, if it still runs then
+        assignments = assignments[np.lexsort((assignments[:, 1], assignments[:, 0]))]
+        assignment_key = assignments[:, 0] * (1 << 32) + assignments[:, 1]
+        candidate = np.searchsorted(assignment_key, group_employee.astype(np.int64) * (1 << 32) + group_day, side="right") - 1
+        safe_candidate = np.maximum(candidate, 0)
+        assigned = (
+            (candidate >= 0)
+            & (assignments[safe_candidate, 0] == group_employee)
+            & (assignments[safe_candidate, 2] >= group_day)
+        )
+        shift_start = np.where(assigned, assignments[safe_candidate, 3], shift_start)
+        shift_end = np.where(assigned, assignments[safe_candidate, 4], shift_end)
+    # shifts ending after midnight end on the next day
+    shift_end = np.where(shift_end <= shift_start, shift_end + SECONDS_PER_DAY, shift_end)
+
+    day_start = group_day * SECONDS_PER_DAY
+    late_minutes = np.round(np.maximum(first_in - (day_start + shift_start), 0) / 60, 1)
+    early_minutes = np.round(np.maximum(day_start + shift_end - last_out, 0) / 60, 1)
+    working_hours = np.round((last_out - first_in) / 3600, 2)
+
+    rows = []
+    for i in np.flatnonzero(has_in | has_out):
+        employee = employees[group_employee[i]]
+        rows.append({
+            "employee": employee,
+            "employee_name": names[employee],
+            "attendance_date": (EPOCH + datetime.timedelta(days=int(group_day[i]))).date(),
+            "in_time": EPOCH + datetime.timedelta(seconds=int(first_in[i])) if has_in[i] else None,
+            "out_time": EPOCH + datetime.timedelta(seconds=int(last_out[i])) if has_out[i] else None,
+            "working_hours": float(working_hours[i]) if has_in[i] and has_out[i] else None,
+            "custom_late_entry_in_minutes": float(late_minutes[i]) if has_in[i] else None,
+            "custom_early_exit_in_minutes": float(early_minutes[i]) if has_out[i] else None,
+        })
+    return rows
@@ -0,0 +1,118 @@
+import frappe
+
+EMPLOYEE_CACHE_KEY = "fingerprint_employees_by_{0}"
+UNKNOWN_EMPLOYEE_CACHE_KEY = "fingerprint_unknown_{0}"
+HOLIDAY_CACHE_KEY = "fingerprint_holiday_dates"
+SHIFT_TIMING_CACHE_KEY = "fingerprint_shift_timings"
+
+
+def load_employees(employee_fieldname="attendance_device_id"):
+    employees = frappe.get_all(
+        "Employee",
+        filters={employee_fieldname: ["is", "set"]},
+        fields=["name", "employee_name", employee_fieldname],
+    )
+    return {
+        str(employee[employee_fieldname]): (employee.name, employee.employee_name)
+        for employee in employees
+    }
+
+
+def get_employee_map(employee_fieldname="attendance_device_id"):
+    """Returns {device user id: (employee, employee_name)}, False for ids get_employee found unknown.
+
+    Loaded with one query the first time an import needs it and shared with every worker
+    through the site's Redis cache, until an Employee is saved or deleted.
+    """
+    return frappe.cache().get_value(
+        EMPLOYEE_CACHE_KEY.format(employee_fieldname),
+        generator=lambda: load_employees(employee_fieldname),
+    )
+
+
+def get_employee(employee_field_value, employee_fieldname="attendance_device_id", employees=None):
+    """Returns (employee, employee_name) of a device user id, or None for an unknown id.
+
+    Unknown ids are recorded once in a negative cache instead of failing the row,
+    see get_unknown_employee_field_values.
+    """
+    if employees is None:
+        employees = get_employee_map(employee_fieldname)
+    employee_field_value = str(employee_field_value)
+    employee = employees.get(employee_field_value)
+    if employee is None:
+        frappe.cache().hset(UNKNOWN_EMPLOYEE_CACHE_KEY.format(employee_fieldname), employee_field_value, 1)
+        # get_employee_map returns the map kept in frappe's request-local cache, this marks the id
+        # for every caller in the request or job on purpose: later rows with it skip Redis. Only
+        # the local copy changes, Redis keeps the map as loaded.
+        employees[employee_field_value] = False
+    return employee or None
+
+
+def get_unknown_employee_field_values(employee_fieldname="attendance_device_id"):
+    """Device user ids seen in imports that no Employee is linked to."""
+    unknown = frappe.cache().hgetall(UNKNOWN_EMPLOYEE_CACHE_KEY.format(employee_fieldname)) or {}
+    return sorted(key.decode() if isinstance(key, bytes) else key for key in unknown)
+
+
+def clear_employee_cache(doc=None, method=None):
+    """Employee on_update / on_trash hook, an edited device id may also resolve a previously unknown one."""
+    frappe.cache().delete_keys("fingerprint_employees_by_")
+    frappe.cache().delete_keys("fingerprint_unknown_")
+
+
+def load_holiday_dates(holiday_list):
+    return frozenset(
+        frappe.db.sql_list(
+            """SELECT holiday_date FROM `tabHoliday` WHERE parent = %s AND parenttype = 'Holiday List'""",
+            (holiday_list,),
+        )
+    )
+
+
+def get_holiday_dates(holiday_list):
+    """Returns the set of dates of a Holiday List, checking a day is then a set lookup.
+
+    Each list is loaded once and shared through the site's Redis cache until it is saved again.
+    """
+    if not holiday_list:
+        return frozenset()
+    return frappe.cache().hget(HOLIDAY_CACHE_KEY, holiday_list, generator=lambda: load_holiday_dates(holiday_list))
+
+
+def clear_holiday_cache(doc, method=None):
+    """Holiday List on_update / on_trash hook."""
+    frappe.cache().hdel(HOLIDAY_CACHE_KEY, doc.name)
+
+
+def load_shift_timing(shift_type):
+    start_time, end_time = frappe.db.get_value("Shift Type", shift_type, ["start_time", "end_time"]) or (None, None)
+    return (str(start_time) if start_time else None, str(end_time) if end_time else None)
+
+
+def get_shift_timing(shift_type):
+    """Returns (start_time, end_time) of a Shift Type as "HH:MM:SS" strings, cached until it is saved."""
+    if not shift_type:
+        return (None, None)
+    return frappe.cache().hget(SHIFT_TIMING_CACHE_KEY, shift_type, generator=lambda: load_shift_timing(shift_type))
+
+
+def clear_shift_timing_cache(doc, method=None):
+    """Shift Type on_update / on_trash hook."""
+    frappe.cache().hdel(SHIFT_TIMING_CACHE_KEY, doc.name)
+
+
+def in_bulk_attendance():
+    """True while attendance is marked in bulk, when per-row checks and messages are skipped."""
+    return bool(frappe.flags.fingerprint_bulk_attendance or frappe.flags.in_import or frappe.flags.in_patch)
+
+
+@frappe.whitelist()
+def get_attendance_shift_timing(shift_type):
+    """Shift timing for the "calculate early exit and late entry" server script.
+
+    Server scripts can't import app modules but can frappe.call this, and can't see the flags
+    of the request they run in, so whether to stay quiet is returned along with the timing.
+    """
+    start_time, end_time = get_shift_timing(shift_type)
+    return frappe._dict(start_time=start_time, end_time=end_time, quiet=in_bulk_attendance())
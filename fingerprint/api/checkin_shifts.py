@@ -0,0 +1,114 @@
+"""Shift fields of imported Employee Checkins, resolved in memory for a whole import.
+
+Employee Checkin.fetch_shift asks hrms for the shift of every checkin, which queries Shift
+Assignments, the default shift and holidays of the previous, current and next day each time.
+CheckinShifts loads all of them for the employees and window of an import once and applies
+the same rules: an employee's shifts of a day are their Shift Assignments active on it, or
+their default shift, none on a holiday of the shift's (or else the employee's) holiday list.
+A checkin belongs to the first shift of the day before, the day itself or the day after
+whose actual start and end (the shift widened by its check-in and check-out allowances)
+contain it, as hrms' get_exact_shift picks it.
+"""
+import datetime
+from collections import defaultdict
+
+import frappe
+
+from fingerprint.api.attendance_engine import to_seconds
+from fingerprint.api.cache import get_holiday_dates
+
+ONE_DAY = datetime.timedelta(days=1)
+NO_SHIFT = (None, None, None, None, None)
+
+
+class CheckinShifts:
+    """(shift, shift_start, shift_end, shift_actual_start, shift_actual_end) of checkins of
+    `employees` between start_date and end_date, see get_shift_fields."""
+
+    def __init__(self, employees, start_date, end_date):
+        employees = list(employees)
+        self.shift_types = {
+            shift.name: shift
+            for shift in frappe.get_all(
+                "Shift Type",
+                fields=[
+                    "name", "start_time", "end_time", "holiday_list",
+                    "begin_check_in_before_shift_start_time", "allow_check_out_after_shift_end_time",
+                ],
+            )
+        }
+        self.employees = {}
+        self.assignments = defaultdict(list)
+        # {(employee, day): [shift window]}
+        self.day_shifts = {}
+        if not employees:
+            return
+
+        company_holiday_lists = dict(
+            frappe.get_all("Company", fields=["name", "default_holiday_list"], as_list=True)
+        )
+        for employee in frappe.get_all(
+            "Employee",
+            filters={"name": ["in", employees]},
+            fields=["name", "default_shift", "holiday_list", "company"],
+        ):
+            self.employees[employee.name] = (
+                employee.default_shift,
+                employee.holiday_list or company_holiday_lists.get(employee.company),
+            )
+        # a checkin can belong to the shift of the day before or after it
+        for assignment in frappe.get_all(
+            "Shift Assignment",
+            filters={
+                "employee": ["in", employees],
+                "docstatus": 1,
+                "status": "Active",
+                "start_date": ["<=", end_date + ONE_DAY],
+            },
+            or_filters=[["end_date", "is", "not set"], ["end_date", ">=", start_date - ONE_DAY]],
+            fields=["employee", "shift_type", "start_date", "end_date"],
+        ):
+            self.assignments[assignment.employee].append(assignment)
+
+    def get_shift_window(self, shift_type, day, holiday_list):
+        """The shift of a Shift Type starting on day, None without timings or on a holiday."""
+        shift = self.shift_types.get(shift_type)
+        if not shift or shift.start_time is None or shift.end_time is None:
+            return None
+        start_time, end_time = to_seconds(shift.start_time), to_seconds(shift.end_time)
+        start = datetime.datetime.combine(day, datetime.time()) + datetime.timedelta(seconds=start_time)
+        if start.date() in get_holiday_dates(shift.holiday_list or holiday_list):
+            return None
+        # shifts starting later than they end end on the next day
+        end = datetime.datetime.combine(day + ONE_DAY if start_time > end_time else day, datetime.time())
+        end += datetime.timedelta(seconds=end_time)
+        return (
+            shift_type,
+            start,
+            end,
+            start - datetime.timedelta(minutes=shift.begin_check_in_before_shift_start_time or 0),
+            end + datetime.timedelta(minutes=shift.allow_check_out_after_shift_end_time or 0),
+        )
+
+    def get_day_shifts(self, employee, day):
+        key = (employee, day)
+        if key not in self.day_shifts:
+            default_shift, holiday_list = self.employees.get(employee, (None, None))
+            shift_types = [
+                assignment.shift_type
+                for assignment in self.assignments[employee]
+                if assignment.start_date <= day and (not assignment.end_date or assignment.end_date >= day)
+            ] or [default_shift]
+            shifts = (self.get_shift_window(shift_type, day, holiday_list) for shift_type in shift_types)
+            self.day_shifts[key] = sorted(
+                (shift for shift in shifts if shift), key=lambda shift: shift[3]
+            )
+        return self.day_shifts[key]
+
+    def get_shift_fields(self, employee, timestamp):
+        day = timestamp.date()
+        for shift_day in (day - ONE_DAY, day, day + ONE_DAY):
+            for shift in self.get_day_shifts(employee, shift_day):
+                if shift[3] <= timestamp <= shift[4]:
+                    return shift
+        return NO_SHIFT
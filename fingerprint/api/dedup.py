@@ -0,0 +1,95 @@
+import frappe
+import hashlib
+import math
+
+# windows holding more stored checkins than this are checked with a bloom filter instead of a set
+BLOOM_FILTER_THRESHOLD = 2000000
+BLOOM_FILTER_ERROR_RATE = 0.001
+CONFIRM_BATCH_SIZE = 500
+
+
+class BloomFilter:
+    """Fixed size bloom filter, `key in bloom` is never wrong for stored keys but may be for others."""
+
+    def __init__(self, capacity, error_rate=BLOOM_FILTER_ERROR_RATE):
+        capacity = max(capacity, 1)
+        self.size = max(8, int(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hash_count = max(1, round(self.size / capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+
+    def get_positions(self, key):
+        digest = hashlib.blake2b(repr(key).encode(), digest_size=16).digest()
+        # double hashing, k positions out of two 64 bit hashes
+        first = int.from_bytes(digest[:8], "little")
+        second = int.from_bytes(digest[8:], "little") | 1
+        return [(first + i * second) % self.size for i in range(self.hash_count)]
+
+    def add(self, key):
+        for position in self.get_positions(key):
+            self.bits[position >> 3] |= 1 << (position & 7)
+
+    def __contains__(self, key):
+        return all(self.bits[position >> 3] & (1 << (position & 7)) for position in self.get_positions(key))
+
+
+def get_stored_keys(start, end):
+    """(employee, time, device_id) of every Employee Checkin between start and end."""
+    return set(
+        frappe.db.sql(
+            """SELECT employee, time, device_id FROM `tabEmployee Checkin` WHERE time BETWEEN %s AND %s""",
+            (start, end),
+        )
+    )
+
+
+def get_stored_keys_bloom_filter(start, end, count):
+    bloom = BloomFilter(count)
+    with frappe.db.unbuffered_cursor():
+        for key in frappe.db.sql(
+            """SELECT employee, time, device_id FROM `tabEmployee Checkin` WHERE time BETWEEN %s AND %s""",
+            (start, end),
+            as_iterator=True,
+        ):
+            bloom.add(tuple(key))
+    return bloom
+
+
+def confirm_stored_keys(keys):
+    """Exact lookup of the keys a bloom filter reported, to rule out its false positives."""
+    keys = list(keys)
+    stored = set()
+    for i in range(0, len(keys), CONFIRM_BATCH_SIZE):
+        batch = keys[i:i + CONFIRM_BATCH_SIZE]
+        stored.update(
+            frappe.db.sql(
+                """SELECT employee, time, device_id FROM `tabEmployee Checkin`
+                WHERE (employee, time) IN %(keys)s""",
+                {"keys": tuple((employee, time) for employee, time, device_id in batch)},
+            )
+        )
+    return stored.intersection(keys)
+
+
+def find_stored_checkins(keys):
+    """Returns the (employee, time, device_id) keys that already have an Employee Checkin.
+
+    The stored keys of the window are preloaded into a set, or streamed into a bloom filter
+    when the window holds more than BLOOM_FILTER_THRESHOLD checkins, so every key is checked
+    in memory and a re-import costs a single scan of the window.
+    """
+    keys = set(keys)
+    if not keys:
+        return set()
+
+    start = min(time for employee, time, device_id in keys)
+    end = max(time for employee, time, device_id in keys)
+    count = frappe.db.sql(
+        """SELECT COUNT(*) FROM `tabEmployee Checkin` WHERE time BETWEEN %s AND %s""", (start, end)
+    )[0][0]
+    if not count:
+        return set()
+    if count <= BLOOM_FILTER_THRESHOLD:
+        return keys & get_stored_keys(start, end)
+
+    bloom = get_stored_keys_bloom_filter(start, end, count)
+    return confirm_stored_keys(key for key in keys if key in bloom)
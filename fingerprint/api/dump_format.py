@@ -0,0 +1,135 @@
+"""Binary columnar dump format, written by the collector's write_dump.
+
+A dump is a header, every user id once, then one fixed-width column per record field:
+
+    header      b"FPDUMP", version u16, record count u64, user id count u32, user ids size u32
+    user ids    utf-8, "\\0" separated, zero padded to a multiple of 8 bytes
+    timestamp   float64, epoch seconds as datetime.timestamp() returns them
+    uid         uint32
+    user        uint32, index of the record's user id
+    status      uint8
+    punch       uint8
+
+Everything is little-endian. Dumps written before this format are json lists of records and
+are still read by fetch_checkins.read_dump.
+"""
+import gzip
+import mmap
+import struct
+
+import numpy as np
+
+from fingerprint.api.punch import Punch
+
+MAGIC = b"FPDUMP"
+VERSION = 1
+HEADER = struct.Struct("<6sHQII")
+# widest first, so every column starts aligned to its item size
+COLUMNS = (("timestamp", "<f8"), ("uid", "<u4"), ("user", "<u4"), ("status", "u1"), ("punch", "u1"))
+RECORD_SIZE = sum(np.dtype(dtype).itemsize for name, dtype in COLUMNS)
+
+
+def get_padded_size(size):
+    return -(-size // 8) * 8
+
+
+def get_dump_size(header):
+    """Size in bytes of the binary dump a header starts, raises ValueError if it isn't one."""
+    if len(header) != HEADER.size:
+        raise ValueError("truncated dump header")
+    magic, version, count, user_count, users_size = HEADER.unpack(header)
+    if magic != MAGIC:
+        raise ValueError("not a binary dump")
+    return HEADER.size + get_padded_size(users_size) + count * RECORD_SIZE
+
+
+def is_binary_dump(file_path):
+    opener = gzip.open if file_path.endswith(".gz") else open
+    with opener(file_path, "rb") as f:
+        return f.read(len(MAGIC)) == MAGIC
+
+
+class BinaryDump:
+    """The columns of a binary dump as numpy arrays, opened as a context manager.
+
+    Uncompressed dumps are memory mapped and the columns are views of the mapping, so opening
+    a dump reads nothing but the header and user ids. gzip compressed dumps can't be mapped,
+    their columns are views of the decompressed bytes. The columns are only valid until the
+    dump is closed.
+    """
+
+    def __init__(self, file_path):
+        self.file_path = file_path
+        self._file = self._mmap = None
+        if file_path.endswith(".gz"):
+            with gzip.open(file_path, "rb") as f:
+                buffer = f.read()
+        else:
+            self._file = open(file_path, "rb")
+            buffer = self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        try:
+            magic, version, count, user_count, users_size = HEADER.unpack_from(buffer)
+            if magic != MAGIC:
+                raise ValueError(f"{file_path} is not a binary dump")
+            if version != VERSION:
+                raise ValueError(f"{file_path} is a version {version} dump, only version {VERSION} can be read")
+
+            offset = HEADER.size
+            self.users = bytes(buffer[offset:offset + users_size]).decode().split("\0") if user_count else []
+            offset += get_padded_size(users_size)
+            for name, dtype in COLUMNS:
+                # raises ValueError when the dump is truncated
+                column = np.frombuffer(buffer, dtype=dtype, count=count, offset=offset)
+                setattr(self, name, column)
+                offset += column.nbytes
+        except Exception:
+            self.close()
+            raise
+
+    def __len__(self):
+        return len(self.timestamp)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        for name, dtype in COLUMNS:
+            self.__dict__.pop(name, None)
+        if self._mmap is not None:
+            try:
+                self._mmap.close()
+            except BufferError:
+                # a view of a column is still referenced, the mapping goes away with it
+                pass
+            self._file.close()
+            self._mmap = self._file = None
+
+    def punches(self, indices=slice(None)):
+        """Punch records of the records at indices (a slice or an index array), all by default."""
+        users = self.users
+        columns = (getattr(self, name)[indices].tolist() for name, dtype in COLUMNS)
+        return [
+            Punch(users[user], timestamp, status, punch, uid)
+            for timestamp, uid, user, status, punch in zip(*columns)
+        ]
+
+
+def write_binary_dump(f, punches):
+    """Writes Punch records, with raw epoch timestamps, to the binary file f.
+
+    The collector has its own copy of this, it is a single file without numpy.
+    """
+    user_codes = {}
+    user = np.fromiter(
+        (user_codes.setdefault(str(punch.user_id), len(user_codes)) for punch in punches), dtype="<u4"
+    )
+    users = "\0".join(user_codes).encode()
+    f.write(HEADER.pack(MAGIC, VERSION, len(user), len(user_codes), len(users)))
+    f.write(users.ljust(get_padded_size(len(users)), b"\0"))
+    for name, dtype in COLUMNS:
+        column = user if name == "user" else np.fromiter((getattr(punch, name) for punch in punches), dtype=dtype)
+        f.write(column.tobytes())
@@ -1,13 +1,31 @@
 import frappe
+import bisect
 import datetime
+import gzip
 import json
 import os
 import logging
+import time
+import numpy as np
 from pickledb import PickleDB
 from logging.handlers import RotatingFileHandler
 # from hrms.hr.doctype.employee_checkin.employee_checkin import add_log_based_on_employee_field
-from collections import defaultdict
-from frappe.utils import cint, get_datetime
+from contextlib import ExitStack, contextmanager
+from operator import attrgetter
+from frappe import _
+from frappe.utils import cint, get_datetime, now_datetime
+from frappe.utils.synchronization import filelock
+from fingerprint.api.checkin_shifts import CheckinShifts
+from fingerprint.api.dedup import find_stored_checkins
+from fingerprint.api.dump_format import BinaryDump, is_binary_dump
+from fingerprint.api.metrics import incr, metrics_context, record_span, save_run_summary, span, start_run
+from fingerprint.api.punch import Punch
+from fingerprint.api.cache import get_employee, get_employee_map, get_unknown_employee_field_values
+from fingerprint.fingerprint.doctype.fingerprint_dump.fingerprint_dump import set_dump_status
+from fingerprint.fingerprint.doctype.fingerprint_import_checkpoint.fingerprint_import_checkpoint import (
+    open_checkpoint,
+    save_checkpoint,
+)
 
 
 def add_log_based_on_employee_field(
@@ -26,24 +44,13 @@ def add_log_based_on_employee_field(
     if not employee_field_value or not timestamp:
         frappe.throw(_("'employee_field_value' and 'timestamp' are required."))
 
-    employee = frappe.db.get_values(
-        "Employee",
-        {employee_fieldname: employee_field_value},
-        ["name", "employee_name", employee_fieldname],
-        as_dict=True,
-    )
-    if employee:
-        employee = employee[0]
-    else:
-        frappe.throw(
-            _("No Employee found for the given employee field value. '{}': {}").format(
-                employee_fieldname, employee_field_value
-            )
-        )
+    employee = get_employee(employee_field_value, employee_fieldname)
+    if not employee:
+        # recorded in the unknown employees cache, see fingerprint.api.cache
+        return None
 
     doc = frappe.new_doc("Employee Checkin")
-    doc.employee = employee.name
-    doc.employee_name = employee.employee_name
+    doc.employee, doc.employee_name = employee
     doc.time = timestamp
     doc.device_id = device_id
     doc.log_type = log_type
@@ -56,6 +63,95 @@ def add_log_based_on_employee_field(
 
     return doc
 
+def get_series_names(doctype, count, naming_series=None):
+    """Names of count new documents of doctype from a naming series, like make_autoname gives
+    them one by one: `naming_series` as set in a naming_series field, else the doctype's
+    autoname. Doctypes named any other way get hashes.
+
+    The numbers are reserved with one update of the series, committed right away so concurrent
+    imports don't wait on the series while they insert."""
+    from frappe.model.naming import parse_naming_series
+
+    if naming_series:
+        # documents with a naming_series field are named `<naming_series>.#####`
+        autoname = naming_series if "#" in naming_series else f"{naming_series.rstrip('.')}.#####"
+    else:
+        autoname = frappe.get_meta(doctype).autoname or ""
+    prefix, _dot, digits = autoname.rpartition(".")
+    if ":" in autoname or not digits or digits.strip("#"):
+        return [frappe.generate_hash(length=10) for i in range(count)]
+
+    series = parse_naming_series(prefix)
+    current = frappe.db.sql("""SELECT `current` FROM `tabSeries` WHERE `name` = %s FOR UPDATE""", (series,))
+    if current and current[0][0] is not None:
+        first = cint(current[0][0]) + 1
+        frappe.db.sql("""UPDATE `tabSeries` SET `current` = `current` + %s WHERE `name` = %s""", (count, series))
+    else:
+        first = 1
+        frappe.db.sql("""INSERT INTO `tabSeries` (`name`, `current`) VALUES (%s, %s)""", (series, count))
+    frappe.db.commit()
+    return [f"{series}{number:0{len(digits)}d}" for number in range(first, first + count)]
+
+def bulk_insert_checkins(device_attendance_logs, device_id=None, batch_size=1000, employee_fieldname="attendance_device_id", progress=None, checkpoint=None):
+    """Inserts Employee Checkins with multi-row INSERTs, skipping document hooks.
+
+    Employees are resolved from the shared employee cache, their shifts from one preload of the
+    window (see fingerprint.api.checkin_shifts), and every batch is committed on its own,
+    after which `progress(done, total, inserted, errors)` is called. `checkpoint(done, inserted, errors)`
+    is called right before each commit, so what it writes is committed with the batch.
+    Returns (inserted, errors).
+    """
+    with span("employee_lookup"):
+        employees = get_employee_map(employee_fieldname)
+    with span("shift_lookup"):
+        shift_employees = {
+            employees[str(log.user_id)][0] for log in device_attendance_logs if employees.get(str(log.user_id))
+        }
+        shifts = CheckinShifts(
+            shift_employees,
+            min(log.timestamp for log in device_attendance_logs).date(),
+            max(log.timestamp for log in device_attendance_logs).date(),
+        )
+    fields = [
+        "name", "owner", "creation", "modified", "modified_by", "docstatus",
+        "employee", "employee_name", "time", "device_id", "log_type", "custom_over_night",
+        "skip_auto_attendance", "shift", "shift_start", "shift_end", "shift_actual_start", "shift_actual_end",
+    ]
+    user = frappe.session.user
+    inserted = 0
+    errors = 0
+    for start in range(0, len(device_attendance_logs), batch_size):
+        now = now_datetime()
+        batch = device_attendance_logs[start:start + batch_size]
+        with span("employee_lookup", len(batch)):
+            batch_employees = [get_employee(log.user_id, employee_fieldname, employees) for log in batch]
+        errors += batch_employees.count(None)
+        # the shift of the employee at the time of the log
+        with span("shift_lookup", len(batch) - batch_employees.count(None)):
+            values = [
+                (
+                    user, now, now, user, 0,
+                    *employee, log.timestamp, device_id, log.log_type,
+                    log.overnight, 0, *shifts.get_shift_fields(employee[0], log.timestamp),
+                )
+                for log, employee in zip(batch, batch_employees)
+                if employee
+            ]
+        if values:
+            with span("insert", len(values)):
+                values = [(name, *row) for name, row in zip(get_series_names("Employee Checkin", len(values)), values)]
+                frappe.db.bulk_insert("Employee Checkin", fields, values)
+            inserted += len(values)
+        done = min(start + batch_size, len(device_attendance_logs))
+        if checkpoint:
+            checkpoint(done, inserted, errors)
+        if values or checkpoint:
+            with span("commit"):
+                frappe.db.commit()
+        if progress:
+            progress(done, len(device_attendance_logs), inserted, errors)
+    return inserted, errors
+
 def setup_logger(name, log_file, level=logging.INFO, formatter=None):
     
     if not formatter:
@@ -79,98 +175,142 @@ if not os.path.exists(LOGS_DIRECTORY):
 error_logger = setup_logger('error_logger', '/'.join([LOGS_DIRECTORY, 'error.log']), logging.ERROR)
 info_logger = setup_logger('info_logger', '/'.join([LOGS_DIRECTORY, 'logs.log']))
 status = PickleDB('/'.join([LOGS_DIRECTORY, 'status.json']))
+IMPORT_PROGRESS_EVENT = "fingerprint_import_progress"
+IMPORT_CANCEL_KEY = "fingerprint_import_cancel_{0}"
+IMPORT_STATE_KEY = "fingerprint_import_state_{0}"
+IMPORT_ERRORS_KEY = "fingerprint_import_errors_{0}"
+IMPORT_LOCK_TIMEOUT = 30 * 60
+# dumps with this many records or more are imported as one shard per week of the import window
+SLICE_RECORD_COUNT = 200000
+OVERNIGHT_CUTOFF_HOUR = 4  # i.e., 00:00 ≤ time < 04:00
+EPOCH = datetime.datetime(1970, 1, 1)
+MICROSECOND = datetime.timedelta(microseconds=1)
 full_site_path = frappe.get_site_path()
 full_site_path = os.path.abspath(frappe.get_site_path())
 
 
+def to_local_datetime(timestamp):
+    """Local time of an epoch timestamp as the collector writes it."""
+    return datetime.datetime.fromtimestamp(timestamp) + datetime.timedelta(hours=3)
+
+def get_record_datetime(record):
+    return to_local_datetime(record.timestamp)
+
 def edit_attendance(record):
-    record['timestamp'] = datetime.datetime.fromtimestamp(record['timestamp']) + datetime.timedelta(hours=3)
+    record.timestamp = get_record_datetime(record)
     return record
 
-def get_shift_date(log):
-    OVERNIGHT_CUTOFF_HOUR = 4  # i.e., 00:00 ≤ time < 04:00
+def select_window(attendances, import_start_date, import_end_date):
+    """Returns the records of a raw dump from import_start_date up to import_end_date, converted.
 
-    ts = log['timestamp']
+    Records are ordered by their raw epoch timestamp (already the device order, so this is a
+    linear pass) and the window bounds are found with binary searches, which convert only
+    the probed records. Records outside the window are never converted.
+    """
+    attendances.sort(key=attrgetter('timestamp'))
+    start = bisect.bisect_left(attendances, import_start_date, key=get_record_datetime)
+    end = bisect.bisect_right(attendances, import_end_date, key=get_record_datetime)
+    return [edit_attendance(att) for att in attendances[start:end]]
+
+def get_shift_date(log):
+    ts = log.timestamp
     if 0 <= ts.hour < OVERNIGHT_CUTOFF_HOUR:
         # Between 00:00 and 02:59:59 inclusive
         minutes_past_midnight = ts.hour * 60 + ts.minute
-        log['overnight'] = minutes_past_midnight
-        log['timestamp'] = datetime.datetime.combine(
+        log.overnight = minutes_past_midnight
+        log.timestamp = datetime.datetime.combine(
         ts.date() - datetime.timedelta(days=1),
         datetime.time(23, 59, 59)
         )
     else:
-        log['overnight'] = 0  # or None / omit key
-    log['shift_date'] = log['timestamp'].date()
+        log.overnight = 0  # or None / omit key
+    log.shift_date = log.timestamp.date()
     return log
 
 def add_punch_direction(device_attendance_logs):
-    # Step 1: Assign 'shift_date' to every log
-    for log in device_attendance_logs:
-        # log['timestamp'] = log['timestamp'] + datetime.timedelta(hours=10) # test over night shift type
-        log = get_shift_date(log)
-
-    # Step 2: Group logs by (user_id, shift_date)
-    # key: (user_id, shift_date), value: list of logs
-    groups = defaultdict(list)
-    for log in device_attendance_logs:
-        key = (log['user_id'], log['shift_date'])
-        groups[key].append(log)
-    # Step 3: For each (user, shift_day) group, mark first as 'IN', last as 'OUT'
-    for day_logs in groups.values():
-        # Sort by actual timestamp
-        day_logs_sorted = sorted(day_logs, key=lambda x: x['timestamp'])
-        
-        # Default: mark all as 'OTHER' first
-        for log in day_logs_sorted:
-            log['log_type'] = 'OTHER'
-
-        # if len(day_logs_sorted)>2:
-        #     print(day_logs_sorted)
-
-        if len(day_logs_sorted) == 1:
-            day_logs_sorted[0]['log_type'] = 'IN'
-        if len(day_logs_sorted) > 1:
-            day_logs_sorted[0]['log_type'] = 'IN'
-            day_logs_sorted[-1]['log_type'] = 'OUT'
-
-    # Optional: sort entire list chronologically for consistency
-    device_attendance_logs.sort(key=lambda x: x['timestamp'])
-
-    # # Filter: all keys where first element (user_id) == '608'
-    # user_608_entries = []
-    # for device_attendance_log in device_attendance_logs:
-    #     if device_attendance_log['user_id'] == '482':
-    #         user_608_entries.append(device_attendance_log)
-
-    # Return the now-modified input list
+    """Sets shift_date, overnight and log_type of every log, then orders the logs by time.
+
+    Per (user_id, shift_date) the earliest log is IN, the latest OUT and the rest OTHER, a lone
+    log is IN. Logs before OVERNIGHT_CUTOFF_HOUR belong to the previous day's shift, see
+    get_shift_date, which this computes for all logs at once: the logs are turned into arrays,
+    ordered with one stable lexsort by (user_id, shift_date, timestamp), and the first and
+    last log of each group found from where the group key changes.
+    """
+    if not device_attendance_logs:
+        return device_attendance_logs
+
+    user_codes = {}
+    users = np.fromiter(
+        (user_codes.setdefault(log.user_id, len(user_codes)) for log in device_attendance_logs),
+        dtype=np.int64,
+        count=len(device_attendance_logs),
+    )
+    # numpy converts datetime objects slowly, their offsets from the epoch are plain ints
+    timestamps = np.fromiter(
+        ((log.timestamp - EPOCH) // MICROSECOND for log in device_attendance_logs),
+        dtype=np.int64,
+        count=len(device_attendance_logs),
+    ).view('datetime64[us]')
+    days = timestamps.astype('datetime64[D]')
+    time_of_day = timestamps - days
+    overnight = time_of_day < np.timedelta64(OVERNIGHT_CUTOFF_HOUR, 'h')
+    # overnight logs become 23:59:59 of the previous day
+    timestamps = np.where(overnight, days - np.timedelta64(1, 's'), timestamps)
+    shift_dates = timestamps.astype('datetime64[D]')
+    overnight_minutes = np.where(overnight, time_of_day.astype('timedelta64[m]').astype(np.int64), 0)
+
+    # stable, so logs with the same timestamp keep their order like sorted() did
+    order = np.lexsort((timestamps, shift_dates, users))
+    group_key_changes = (users[order][1:] != users[order][:-1]) | (shift_dates[order][1:] != shift_dates[order][:-1])
+    first = np.r_[True, group_key_changes]
+    last = np.r_[group_key_changes, True]
+    log_types = np.full(len(order), 2, dtype=np.int8)
+    log_types[order[last]] = 1
+    # a lone log is both first and last, and IN
+    log_types[order[first]] = 0
+
+    log_type_names = ('IN', 'OUT', 'OTHER')
+    for log, shift_date, minutes, log_type in zip(
+        device_attendance_logs, shift_dates.tolist(), overnight_minutes.tolist(), log_types.tolist()
+    ):
+        log.overnight = minutes
+        log.shift_date = shift_date
+        log.log_type = log_type_names[log_type]
+    for i in np.flatnonzero(overnight).tolist():
+        device_attendance_logs[i].timestamp = datetime.datetime.combine(
+            device_attendance_logs[i].shift_date, datetime.time(23, 59, 59)
+        )
+
+    # chronological, stable like list.sort
+    device_attendance_logs[:] = [device_attendance_logs[i] for i in np.argsort(timestamps, kind='stable').tolist()]
     return device_attendance_logs
 
-def process_device_attendance_logs(device_attendance_logs, company, chunk_size=100):
-    total = len(device_attendance_logs)
-    if total == 0:
-        frappe.msgprint(_("No logs to process."))
-        return
+def process_device_attendance_logs(device_attendance_logs, company, chunk_size=100, progress=None, checkpoint=None):
+    """Inserts every log as an Employee Checkin document, so its validations and hooks run.
 
+    Commits in chunks, calling `checkpoint(done, inserted, errors)` right before and
+    `progress(done, total, inserted, errors)` after each one.
+    Returns (inserted, errors).
+    """
+    total = len(device_attendance_logs)
     processed = 0
     errors = 0
-
-    frappe.publish_realtime(
-        "msgprint", 
-        _("Starting processing of {0} attendance logs...").format(total),
-        user=frappe.session.user
-    )
+    chunk_start = time.perf_counter()
 
     for i, device_attendance_log in enumerate(device_attendance_logs):
         try:
-            add_log_based_on_employee_field(
-                user_id=device_attendance_log['user_id'],
-                timestamp=device_attendance_log['timestamp'],
-                company=company,
-                log_type=device_attendance_log['log_type'],
-                over_night=device_attendance_log.get('overnight', 0)
+            # device_id keeps what this path has always stored
+            doc = add_log_based_on_employee_field(
+                device_attendance_log.user_id,
+                device_attendance_log.timestamp,
+                device_id=company,
+                log_type=device_attendance_log.log_type,
+                over_night=device_attendance_log.overnight
             )
-            processed += 1
+            if doc:
+                processed += 1
+            else:
+                errors += 1
 
         except Exception as e:
             errors += 1
@@ -182,113 +322,410 @@ def process_device_attendance_logs(device_attendance_logs, company, chunk_size=1
 
         # 🟢 Commit in chunks & update progress
         if (i + 1) % chunk_size == 0 or i == total - 1:
-            frappe.db.commit()  # Save this chunk
-            
-            # Update progress (with ETA estimation)
-            percent_complete = int((i + 1) / total * 100)
-            frappe.publish_progress(
-                percent=percent_complete,
-                title=_("Processing Attendance Logs"),
-                description=_("Processed {0}/{1} logs ({2} errors)").format(i + 1, total, errors)
-            )
-
-    # ✅ Final summary
-    summary = _("✅ Completed: {0}/{1} logs processed").format(processed, total)
-    if errors:
-        summary += _(" | ⚠️ {0} failed (see Error Log)").format(errors)
-
-    frappe.msgprint(summary, title=_("Attendance Import"), indicator="green" if not errors else "orange")
-    frappe.publish_realtime(
-        "list_update", 
-        {"doctype": "Employee Checkin"},  # refresh Employee Checkin list
-        user=frappe.session.user
-    )
-
-def pull_process_and_push_data(file_path, import_start_date, import_end_date, company):
+            # each document is looked up, validated and inserted on its own, timed as one stage
+            record_span("insert", time.perf_counter() - chunk_start, i % chunk_size + 1)
+            if checkpoint:
+                checkpoint(i + 1, processed, errors)
+            with span("commit"):
+                frappe.db.commit()  # Save this chunk
+            chunk_start = time.perf_counter()
+            if progress:
+                progress(i + 1, total, processed, errors)
+
+    return processed, errors
+
+def read_dump(file_path):
+    """Loads the punches of a dump uploaded by the collector as Punch records.
+
+    Reads binary dumps (see fingerprint.api.dump_format) and the json dumps of older collectors,
+    gzip compressed dumps are decompressed on the fly.
+    """
+    if is_binary_dump(file_path):
+        with BinaryDump(file_path) as dump:
+            return dump.punches()
+    opener = gzip.open if file_path.endswith(".gz") else open
+    with opener(file_path, "rt") as f:
+        return json.load(f, object_hook=Punch.from_dict)
+
+def read_dump_window(file_path, import_start_date, import_end_date):
+    """select_window of a dump. Only the records of a binary dump inside the window are read,
+    its bounds are searched in the memory mapped timestamp column.
+    """
+    if not is_binary_dump(file_path):
+        return select_window(read_dump(file_path), import_start_date, import_end_date)
+
+    with BinaryDump(file_path) as dump:
+        timestamps = dump.timestamp
+        order = None
+        if (timestamps[1:] < timestamps[:-1]).any():
+            order = np.argsort(timestamps, kind='stable')
+            timestamps = timestamps[order]
+        start = bisect.bisect_left(timestamps, import_start_date, key=to_local_datetime)
+        end = bisect.bisect_right(timestamps, import_end_date, key=to_local_datetime)
+        del timestamps
+        punches = dump.punches(slice(start, end) if order is None else order[start:end])
+    return [edit_attendance(punch) for punch in punches]
+
+def get_dump_summary(file_path):
+    """(record count, earliest, latest raw timestamp) of a dump, the timestamps are None when it is empty."""
+    if is_binary_dump(file_path):
+        with BinaryDump(file_path) as dump:
+            if not len(dump):
+                return 0, None, None
+            return len(dump), float(dump.timestamp.min()), float(dump.timestamp.max())
+    timestamps = [punch.timestamp for punch in read_dump(file_path)]
+    if not timestamps:
+        return 0, None, None
+    return len(timestamps), min(timestamps), max(timestamps)
+
+def filter_stored_checkins(device_attendance_logs, device_id=None, employee_fieldname="attendance_device_id"):
+    """Drops the logs already stored as an Employee Checkin with the same (employee, time, device_id).
+
+    Runs before shifts are looked up or anything is inserted, so re-importing a window that
+    was already imported costs little more than reading the dump.
+    """
+    employees = get_employee_map(employee_fieldname)
+    keys = {}
+    for i, log in enumerate(device_attendance_logs):
+        employee = employees.get(str(log.user_id))
+        if employee:
+            keys[i] = (employee[0], log.timestamp, device_id)
+    stored = find_stored_checkins(keys.values())
+    if not stored:
+        return device_attendance_logs
+    return [log for i, log in enumerate(device_attendance_logs) if keys.get(i) not in stored]
+
+def pull_process_and_push_data(file_path, import_start_date, import_end_date, company, use_document_hooks=False, progress=None, dump=None):
     
-    """ Takes a single device config as param and pulls data from that device.
+    """ Takes a single device dump and imports its logs within the import dates as Employee Checkins.
 
     params:
-    device: a single device config object from the local_config file
-    device_attendance_logs: fetching from device is skipped if this param is passed. used to restart failed fetches from previous runs.
+    file_path: dump uploaded by the collector for a single device
+    use_document_hooks: insert every checkin as a document (validations and hooks run) instead of in bulk
+    progress: called as progress(done, total, inserted, errors) after every committed batch
+    dump: Fingerprint Dump of file_path. When given, every batch is committed with a Fingerprint Import
+        Checkpoint, and an import of the same window that was interrupted resumes after its last batch.
+
+    Returns (inserted, errors).
     """
+    import_start_date = get_datetime(import_start_date)
+
+    import_end_date = get_datetime(import_end_date)
+
     try:
-        content = open(file_path, 'r').read()
-    except:
+        with span("parse") as parsed:
+            device_attendance_logs = read_dump_window(file_path, import_start_date, import_end_date)
+            parsed.records = len(device_attendance_logs)
+    except FileNotFoundError:
         frappe.msgprint(f"file {file_path} is not exist")
-    attendances = json.loads(content)
-    updated_attendances = [edit_attendance(att) for att in attendances]
-    attendances = sorted(updated_attendances, key=lambda x: x['timestamp'])
+        return 0, 0
 
-    device_attendance_logs = attendances
     if not device_attendance_logs:
-        return
+        return 0, 0
 
-    import_start_date = datetime.datetime.strptime(import_start_date, '%Y-%m-%d')
+    # Process logs between start and end date
+    with span("add_punch_direction", len(device_attendance_logs)):
+        device_attendance_logs = add_punch_direction(device_attendance_logs)
+    total = len(device_attendance_logs)
+    with lock_import_window(company, import_start_date, import_end_date):
+        checkpoint = open_checkpoint(dump, import_start_date, import_end_date, total) if dump else None
+        offset = checkpoint.last_offset if checkpoint else 0
+        if offset:
+            info_logger.info(f"Resuming {file_path} after {offset} of {total} records")
+        # the window is in the same order on every run, the records before offset are committed
+        pending = device_attendance_logs[offset:]
+        # device_id keeps what the per-document path has always stored
+        with span("dedup", len(pending)):
+            device_attendance_logs = filter_stored_checkins(pending, device_id=company)
+        positions = {id(log): offset + i for i, log in enumerate(pending)}
+
+        def save_progress(done, inserted, errors):
+            # offset after the last log of the batch, or the whole window after the last batch
+            last_offset = total if done == len(device_attendance_logs) else positions[id(device_attendance_logs[done - 1])] + 1
+            save_checkpoint(checkpoint.name, last_offset, checkpoint.inserted + inserted, checkpoint.errors + errors)
+
+        save_batch = save_progress if checkpoint else None
+        if not device_attendance_logs:
+            inserted = errors = 0
+            if progress:
+                progress(total, total, 0, 0)
+        elif use_document_hooks:
+            inserted, errors = process_device_attendance_logs(
+                device_attendance_logs, company, progress=progress, checkpoint=save_batch
+            )
+        else:
+            inserted, errors = bulk_insert_checkins(
+                device_attendance_logs, device_id=company, progress=progress, checkpoint=save_batch
+            )
+        if checkpoint:
+            save_checkpoint(
+                checkpoint.name, total, checkpoint.inserted + inserted, checkpoint.errors + errors, "Completed"
+            )
+            frappe.db.commit()
+    already_stored = len(pending) - len(device_attendance_logs)
+    incr("checkins_inserted", inserted)
+    incr("checkins_already_stored", already_stored)
+    incr("checkin_errors", errors)
+    info_logger.info(
+        f"Inserted {inserted} checkins from {file_path}, {already_stored} already stored, "
+        f"{offset} imported before, {errors} failed or without employee"
+    )
+    if errors:
+        info_logger.info("Unknown device user ids: " + ", ".join(get_unknown_employee_field_values()))
+    return inserted, errors
+
+
+class ImportCancelled(Exception):
+    pass
+
+def publish_import_progress(import_id, **data):
+    """Streams the state of a background import to the user who started it."""
+    frappe.publish_realtime(IMPORT_PROGRESS_EVENT, {"import_id": import_id, **data}, user=frappe.session.user)
+
+def check_import_cancelled(import_id):
+    if frappe.cache().get_value(IMPORT_CANCEL_KEY.format(import_id)):
+        raise ImportCancelled(import_id)
+
+def update_import_state(import_id, **increments):
+    """Adds to the combined counters of an import's shards and returns all of them."""
+    return update_job_state(IMPORT_STATE_KEY.format(import_id), **increments)
+
+def update_job_state(key, **increments):
+    """Adds to counters shared by the jobs of one run, kept for a day in a Redis hash."""
+    cache = frappe.cache()
+    key = cache.make_key(key)
+    pipeline = cache.pipeline()
+    for field, amount in increments.items():
+        if isinstance(amount, float):
+            pipeline.hincrbyfloat(key, field, amount)
+        else:
+            pipeline.hincrby(key, field, amount)
+    pipeline.expire(key, 24 * 60 * 60)
+    pipeline.hgetall(key)
+    state = pipeline.execute()[-1]
+    return {field.decode(): float(value) for field, value in state.items()}
+
+def get_dump_files(company, import_start_date, import_end_date):
+    """Dumps of the company in the Fingerprint Dump manifest with records inside the import window.
+
+    Segments superseded by a later upload of their week are left out.
+    """
+    return frappe.get_all(
+        "Fingerprint Dump",
+        filters={
+            "company": company,
+            "status": ["!=", "Superseded"],
+            "to_time": [">=", import_start_date],
+            "from_time": ["<=", import_end_date],
+        },
+        fields=["name", "file_url", "record_count"],
+        order_by="from_time asc",
+    )
 
-    import_end_date = datetime.datetime.strptime(import_end_date, '%Y-%m-%d')
+def get_shift_week(timestamp):
+    """Monday of the week of the shift date a timestamp belongs to."""
+    shift_date = (timestamp - datetime.timedelta(hours=OVERNIGHT_CUTOFF_HOUR)).date()
+    return shift_date - datetime.timedelta(days=shift_date.weekday())
+
+def get_week_slices(import_start_date, import_end_date):
+    """Splits an import window at every Monday's overnight cutoff, so no shift date spans two slices."""
+    slices = []
+    slice_start = import_start_date
+    while True:
+        boundary = datetime.datetime.combine(
+            get_shift_week(slice_start) + datetime.timedelta(days=7), datetime.time(OVERNIGHT_CUTOFF_HOUR)
+        )
+        if boundary > import_end_date:
+            slices.append((slice_start, import_end_date))
+            return slices
+        # windows are inclusive on both ends
+        slices.append((slice_start, boundary - datetime.timedelta(microseconds=1)))
+        slice_start = boundary
+
+def get_import_shards(dumps, import_start_date, import_end_date):
+    """One shard per dump, large dumps are split further into one shard per week of the window."""
+    shards = []
+    for dump in dumps:
+        if dump.record_count < SLICE_RECORD_COUNT:
+            shards.append((dump.name, import_start_date, import_end_date))
+        else:
+            shards.extend(
+                (dump.name, slice_start, slice_end)
+                for slice_start, slice_end in get_week_slices(import_start_date, import_end_date)
+            )
+    return shards
+
+@contextmanager
+def lock_import_window(company, import_start_date, import_end_date):
+    """Holds the (company, shift week) locks of a window while its checkins are written.
+
+    Shards of the same company overlapping in time wait for each other, so checking for
+    stored checkins and inserting the rest is never interleaved. The lock can't be narrower:
+    stored checkins are matched by (employee, time, device_id) with the company as device_id,
+    and dumps of different devices can hold the same punches (a legacy dump and a segment of
+    the same device, or device ids that moved when the collector's IP list was reordered).
+    Locks are taken in date order, which keeps shards with multi-week windows from deadlocking.
+    """
+    with ExitStack() as stack:
+        week = get_shift_week(import_start_date)
+        while week <= get_shift_week(import_end_date):
+            stack.enter_context(
+                filelock(f"fingerprint_import_{frappe.scrub(company)}_{week}", timeout=IMPORT_LOCK_TIMEOUT)
+            )
+            week += datetime.timedelta(days=7)
+        yield
 
-    index_of_start = None
-    index_of_end = None
+def set_import_dump_status(import_id, state):
+    """Sets the status of an import's dumps from the combined results of their shards.
 
-    # Find start index
-    for i, x in enumerate(device_attendance_logs):
-        if x['timestamp'] >= import_start_date:
-            index_of_start = i
-            break
+    A dump fails if any of its shards failed, with the errors of all of them, and is pending
+    again if one was cancelled. Dumps a later import started processing since are left to it.
+    """
+    errors = {}
+    for key, error in (frappe.cache().hgetall(IMPORT_ERRORS_KEY.format(import_id)) or {}).items():
+        dump, shard_start = (key.decode() if isinstance(key, bytes) else key).split("\t")
+        errors.setdefault(dump, []).append(f"{shard_start}: {error}")
+    for dump in frappe.get_all(
+        "Fingerprint Dump", filters={"import_id": import_id, "status": "Processing"}, pluck="name"
+    ):
+        if state.get(f"failed\t{dump}"):
+            set_dump_status(dump, "Failed", "\n".join(sorted(errors.get(dump, []))))
+        elif state.get(f"cancelled\t{dump}"):
+            set_dump_status(dump, "Pending")
+        else:
+            set_dump_status(dump, "Processed")
+    frappe.cache().delete_value(IMPORT_ERRORS_KEY.format(import_id))
+
+def import_checkins(import_id, dump, import_start_date, import_end_date, company, use_document_hooks=0):
+    """Background job importing one shard of fetch_checkins, the last shard to finish reports the
+    totals and sets the status of the import's dumps."""
+    dump_doc = frappe.get_doc("Fingerprint Dump", dump)
+    file_path = dump_doc.get_file_path()
+    done_fraction = 0.0
+    inserted = errors = 0
+    cancelled = 0
+    # the shard's result for its dump, combined with its other shards' at fan in
+    dump_result = {}
+
+    def progress(done, total, shard_inserted, shard_errors):
+        nonlocal done_fraction, inserted, errors
+        check_import_cancelled(import_id)
+        state = update_import_state(
+            import_id,
+            progress=done / total - done_fraction,
+            inserted=shard_inserted - inserted,
+            errors=shard_errors - errors,
+        )
+        done_fraction, inserted, errors = done / total, shard_inserted, shard_errors
+        publish_import_progress(
+            import_id,
+            status="running",
+            file_name=os.path.basename(file_path),
+            percent=int(state["progress"] / state["shards"] * 100),
+            inserted=int(state["inserted"]),
+            errors=int(state["errors"]),
+        )
 
-    # Find end index
-    for i, x in enumerate(device_attendance_logs):
-        if x['timestamp'] > import_end_date:
-            index_of_end = i
-            break
+    info_logger.info(f"Processing File: {file_path} from {import_start_date} to {import_end_date}")
+    try:
+        check_import_cancelled(import_id)
+        with metrics_context(import_id, company=company, device=dump_doc.device_id):
+            pull_process_and_push_data(
+                file_path, import_start_date, import_end_date, company, use_document_hooks, progress, dump
+            )
+        info_logger.info("Successfully processed File: "+ file_path)
+    except ImportCancelled:
+        frappe.db.rollback()
+        cancelled = 1
+        dump_result = {f"cancelled\t{dump}": 1}
+    except Exception as e:
+        frappe.db.rollback()
+        dump_result = {f"failed\t{dump}": 1}
+        frappe.cache().hset(IMPORT_ERRORS_KEY.format(import_id), f"{dump}\t{import_start_date}", str(e))
+        update_import_state(import_id, errors=1)
+        frappe.log_error(title="Fingerprint Import Error", message=frappe.get_traceback())
+        publish_import_progress(
+            import_id, status="running", file_name=os.path.basename(file_path), error=str(e)
+        )
 
-    # If end date not found, include all remaining logs
-    if index_of_end is None:
-        index_of_end = len(device_attendance_logs)
+    frappe.db.commit()
 
-    # Process logs between start and end date
-    device_attendance_logs = add_punch_direction(device_attendance_logs[index_of_start:index_of_end])
-    for device_attendance_log in device_attendance_logs:
-        try:
-            add_log_based_on_employee_field(
-                device_attendance_log['user_id'], device_attendance_log['timestamp'], company, device_attendance_log['log_type'], over_night=device_attendance_log['overnight']
-            )
-            # print(f"{device_attendance_log['user_id']} saved at {device_attendance_log['timestamp']}")
+    # fan in: whichever shard finishes last reports the combined result
+    state = update_import_state(
+        import_id, finished=1, progress=1.0 - done_fraction, cancelled=cancelled, **dump_result
+    )
+    if state["finished"] < state["shards"]:
+        return
 
-        except Exception as e:
-            frappe.msgprint(f"Error fetching user {device_attendance_log['user_id']}: {e}")
-            pass
+    set_import_dump_status(import_id, state)
     frappe.db.commit()
+    frappe.cache().delete_value(IMPORT_CANCEL_KEY.format(import_id))
+    info_logger.info(f"Import {import_id} finished: {state}")
+    save_run_summary(import_id, "Import", company)
+    publish_import_progress(
+        import_id,
+        status="cancelled" if state.get("cancelled") else "completed",
+        percent=100,
+        inserted=int(state["inserted"]),
+        errors=int(state["errors"]),
+    )
+    frappe.publish_realtime("list_update", {"doctype": "Employee Checkin"}, user=frappe.session.user)
 
 
 @frappe.whitelist()
-def fetch_checkins(import_start_date, import_end_date, company='Ministry of Information'):
-    req_files_found = False
-    for file_name in os.listdir(full_site_path+'/private/files'):
-        file_path = os.path.join(full_site_path+'/private/files', file_name)
-        if file_path.endswith(f"{company.replace(' ', '_').lower()}_last_fetch_dump.json"):
-            
-            req_files_found = True
-            info_logger.info("Processing File: "+ file_path)
-            
-            try:
-                pull_process_and_push_data(file_path, import_start_date, import_end_date, company)
-                info_logger.info("Successfully processed File: "+ file_path)
-
-                # ✅ Delete the file after successful processing
-                # os.remove(file_path)
-                info_logger.info(f"Deleted file after processing: {file_path}")
-                info_logger.info("Mission Accomplished!")
-            except:
-                frappe.msgprint('exception when calling pull_process_and_push_data function for file '+ file_path)
-    if not req_files_found:
+def fetch_checkins(import_start_date, import_end_date, company='Ministry of Information', use_document_hooks=None):
+    """Queues the import of the company's dumps on the long queue and returns its import id.
+
+    Every dump, or every week of a large dump, is imported by its own job so the shards run in
+    parallel on the available workers. Progress is published to the user as
+    `fingerprint_import_progress` realtime events, combined over all shards.
+    """
+    if use_document_hooks is None:
+        # sites that need Employee Checkin hooks opt in with `fingerprint_use_document_hooks` in site_config
+        use_document_hooks = frappe.conf.get("fingerprint_use_document_hooks")
+    use_document_hooks = cint(use_document_hooks)
+    import_start_date = get_datetime(import_start_date)
+    import_end_date = get_datetime(import_end_date)
+    dumps = get_dump_files(company, import_start_date, import_end_date)
+    if not dumps:
         frappe.throw("""No files found for bio devices of your company, you should upload required json file,
                      to do that click 'Fetch & Upload' button then uncompress downloaded file,
                      then double click 'run_python.bat' file after connect your device with bio devices,
                      then wait until message appear that indicate files are uploaded.
                      """)
-        
+
+    import_id = frappe.generate_hash(length=12)
+    shards = get_import_shards(dumps, import_start_date, import_end_date)
+    start_run(import_id)
+    update_import_state(import_id, shards=len(shards))
+    # a dump being imported by another import is taken over, only the latest import sets its status
+    for dump in dumps:
+        set_dump_status(dump.name, "Processing", import_id=import_id)
+    for dump, shard_start, shard_end in shards:
+        frappe.enqueue(
+            "fingerprint.api.fetch_checkins.import_checkins",
+            queue="long",
+            timeout=4 * 60 * 60,
+            import_id=import_id,
+            dump=dump,
+            import_start_date=shard_start,
+            import_end_date=shard_end,
+            company=company,
+            use_document_hooks=use_document_hooks,
+        )
+    return {"import_id": import_id, "files": len(dumps), "shards": len(shards)}
+
+@frappe.whitelist()
+def get_import_status(import_id):
+    """Combined counters of an import: shards, finished, inserted, errors and cancelled."""
+    return update_import_state(import_id)
+
+@frappe.whitelist()
+def cancel_fetch_checkins(import_id):
+    """Stops a running import after its current batch, batches already committed are kept."""
+    frappe.cache().set_value(IMPORT_CANCEL_KEY.format(import_id), 1, expires_in_sec=24 * 60 * 60)
+    return {"import_id": import_id}
+
 @frappe.whitelist()
 def get_app_info():
-    return {"app_path": frappe.get_app_path("fingerprint")}
\ No newline at end of file
+    return {"app_path": frappe.get_app_path("fingerprint")}
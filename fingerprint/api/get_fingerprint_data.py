@@ -1,8 +1,20 @@
 import datetime
+import gzip
+import hashlib
 import json
 import logging
 import os
+import struct
+import sys
+import threading
+import time
+import uuid
+from array import array
+from collections import defaultdict
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from logging.handlers import RotatingFileHandler
+from types import SimpleNamespace
 
 import requests
 from pickledb import PickleDB
@@ -36,47 +48,282 @@ error_logger = setup_logger(
 )
 info_logger = setup_logger("info_logger", "/".join(["logs", "logs.log"]))
 status = PickleDB("/".join(["logs", "status.json"]))
+# PickleDB rewrites the whole file on save, so writers from the pull threads are serialized
+status_lock = threading.Lock()
+# {(stage, device id): [seconds, calls, records]} of this run, sent with send_run_metrics
+run_metrics = defaultdict(lambda: [0.0, 0, 0])
+run_metrics_lock = threading.Lock()
 
-def get_dump_file_name_and_directory(device_id, device_ip):
 
-    return (
-        "logs"
-        + "/"
-        + device_id
-        + "_"
-        + device_ip.replace(".", "_")
-        + "_last_fetch_dump.json"
+@contextmanager
+def timed(stage, device_id):
+    """Adds the time the block takes to the stage's timings of the run. Set "records" on the
+    yielded dict to count the records the stage handled."""
+
+    result = {"records": 0}
+    start = time.perf_counter()
+    try:
+        yield result
+    finally:
+        with run_metrics_lock:
+            timing = run_metrics[(stage, device_id)]
+            timing[0] += time.perf_counter() - start
+            timing[1] += 1
+            timing[2] += result["records"]
+
+
+def send_run_metrics(url, session, company, run_id, started):
+    """Sends the stage timings of the run to the server, where they are kept as a Fingerprint Run."""
+
+    metrics = [[stage, device_id, *timing] for (stage, device_id), timing in sorted(run_metrics.items())]
+    for stage, device_id, seconds, calls, records in metrics:
+        info_logger.info(f"{device_id}\t{stage}\t{seconds:.2f} s\t{calls} call(s)\t{records} records")
+    try:
+        post_with_retry(
+            session,
+            f"{url}/api/method/fingerprint.api.metrics.record_collector_run",
+            max_attempts=2,
+            data={"company": company, "run_id": run_id, "started": started, "metrics": json.dumps(metrics)},
+        )
+    except Exception as e:
+        info_logger.info(f"Failed to send run metrics: {e}")
+
+# punches before this hour belong to the previous day's shift, as in fetch_checkins
+OVERNIGHT_CUTOFF_HOUR = 4
+
+
+def get_device_file_prefix(device_id, device_ip):
+    return "logs/" + device_id + "_" + device_ip.replace(".", "_")
+
+
+def get_segment_catalog_path(device_id, device_ip):
+    return get_device_file_prefix(device_id, device_ip) + "_segments.json"
+
+
+def get_segment_path(device_id, device_ip, segment_start):
+    return get_device_file_prefix(device_id, device_ip) + f"_{segment_start}_dump_segment.bin"
+
+
+def get_segment_start(timestamp):
+    """Monday of the shift week of a punch, each week of a device is dumped to its own segment."""
+    shift_date = (timestamp - datetime.timedelta(hours=OVERNIGHT_CUTOFF_HOUR)).date()
+    return shift_date - datetime.timedelta(days=shift_date.weekday())
+
+
+def load_segment_catalog(catalog_path):
+    """{segment start: {"file", "count", "last", "uploaded"}} of the segments written for a device."""
+
+    if not os.path.exists(catalog_path):
+        return {}
+    with open(catalog_path) as f:
+        return json.load(f)
+
+
+def save_segment_catalog(catalog_path, catalog):
+    with open(catalog_path + ".tmp", "w") as f:
+        json.dump(catalog, f, indent=1, sort_keys=True)
+    os.replace(catalog_path + ".tmp", catalog_path)
+
+
+def make_watermark(serial, attendances):
+    """High-water mark of a device log: its serial, record count and last record."""
+
+    watermark = {"serial": serial, "count": len(attendances), "uid": None, "user_id": None, "timestamp": None}
+    if attendances:
+        last = attendances[-1]
+        watermark.update(
+            uid=last.uid, user_id=str(last.user_id), timestamp=last.timestamp.isoformat()
+        )
+    return watermark
+
+
+def select_new_attendances(device_id, serial, attendances):
+    """Returns the attendances recorded after the device's watermark.
+
+    The device log is append only, so the punches after the stored record count are the new
+    ones. Everything is returned (full pull) when there is no watermark yet, when the serial
+    number changed (device swapped), when the log shrank, or when the record at the watermark
+    is no longer the same one (log cleared and refilled).
+    """
+
+    with status_lock:
+        watermark = status.get(f"{device_id}_watermark")
+    if not watermark:
+        return attendances
+
+    count = watermark.get("count") or 0
+    if watermark.get("serial") != serial:
+        info_logger.info(f"{device_id}\tSerial changed from {watermark.get('serial')} to {serial}, full pull")
+        return attendances
+    if len(attendances) < count:
+        info_logger.info(f"{device_id}\tLog shrank from {count} to {len(attendances)} records, full pull")
+        return attendances
+    if count:
+        last = attendances[count - 1]
+        if (
+            last.uid != watermark.get("uid")
+            or str(last.user_id) != watermark.get("user_id")
+            or last.timestamp.isoformat() != watermark.get("timestamp")
+        ):
+            info_logger.info(f"{device_id}\tWatermark record not found, device was reset, full pull")
+            return attendances
+    return attendances[count:]
+
+
+def commit_watermark(device_id):
+    """Promotes the watermark of the last pull once its dump has been uploaded."""
+
+    with status_lock:
+        pending = status.get(f"{device_id}_pending_watermark")
+        if pending:
+            status.set(f"{device_id}_watermark", pending)
+            status.set(f"{device_id}_pending_watermark", None)
+        status.set(f"{device_id}_push_timestamp", str(datetime.datetime.now()))
+        status.save()
+
+
+# Binary dump format, read by fingerprint.api.dump_format on the server, keep the two in sync
+DUMP_MAGIC = b"FPDUMP"
+DUMP_VERSION = 1
+DUMP_HEADER = struct.Struct("<6sHQII")
+
+
+def write_dump(f, attendances):
+    """Writes attendances to the binary file f as a header, the user ids once, then one
+    fixed-width little-endian column per field: timestamp, uid, user id index, status, punch.
+    """
+
+    user_codes = {}
+    users = array("I", (user_codes.setdefault(str(attendance.user_id), len(user_codes)) for attendance in attendances))
+    user_ids = "\0".join(user_codes).encode()
+    columns = (
+        array("d", (attendance.timestamp.timestamp() for attendance in attendances)),
+        array("I", (attendance.uid for attendance in attendances)),
+        users,
+        array("B", (attendance.status for attendance in attendances)),
+        array("B", (attendance.punch for attendance in attendances)),
     )
+    f.write(DUMP_HEADER.pack(DUMP_MAGIC, DUMP_VERSION, len(attendances), len(user_codes), len(user_ids)))
+    f.write(user_ids.ljust(-(-len(user_ids) // 8) * 8, b"\0"))
+    for column in columns:
+        if sys.byteorder == "big":
+            column.byteswap()
+        column.tofile(f)
+
+
+def read_dump(path):
+    """Reads back a dump written by write_dump, as records with the attributes of pyzk's Attendance."""
+
+    with open(path, "rb") as f:
+        data = f.read()
+    magic, version, count, user_count, users_size = DUMP_HEADER.unpack_from(data)
+    if magic != DUMP_MAGIC or version != DUMP_VERSION:
+        raise ValueError(f"{path} is not a version {DUMP_VERSION} dump")
+    offset = DUMP_HEADER.size
+    user_ids = data[offset:offset + users_size].decode().split("\0")
+    offset += -(-users_size // 8) * 8
+    columns = []
+    for typecode in ("d", "I", "I", "B", "B"):
+        column = array(typecode)
+        column.frombytes(data[offset:offset + count * column.itemsize])
+        if sys.byteorder == "big":
+            column.byteswap()
+        columns.append(column)
+        offset += count * column.itemsize
+    return [
+        SimpleNamespace(
+            uid=uid,
+            user_id=user_ids[user],
+            timestamp=datetime.datetime.fromtimestamp(timestamp),
+            status=status,
+            punch=punch,
+        )
+        for timestamp, uid, user, status, punch in zip(*columns)
+    ]
+
+
+def write_segments(device_id, device_ip, attendances):
+    """Adds attendances to the segments of their shift weeks and returns how many segments changed.
+
+    A segment is merged with the records it already holds, so it only ever grows and a week
+    that got no new punch is neither rewritten nor uploaded again. Changed segments are marked
+    for upload in the device's segment catalog.
+    """
+
+    catalog_path = get_segment_catalog_path(device_id, device_ip)
+    catalog = load_segment_catalog(catalog_path)
+    weeks = defaultdict(list)
+    for attendance in attendances:
+        weeks[get_segment_start(attendance.timestamp).isoformat()].append(attendance)
+
+    written = 0
+    for segment_start, records in sorted(weeks.items()):
+        path = get_segment_path(device_id, device_ip, segment_start)
+        entry = catalog.get(segment_start)
+        last = max(record.timestamp for record in records).isoformat()
+        if entry and entry["count"] == len(records) and entry["last"] == last:
+            # a full pull of a week that is already dumped
+            continue
+
+        merged = {}
+        if entry and os.path.exists(path):
+            merged = {(str(record.user_id), record.timestamp): record for record in read_dump(path)}
+        count = len(merged)
+        for record in records:
+            merged.setdefault((str(record.user_id), record.timestamp), record)
+        if entry and len(merged) == count:
+            continue
+
+        records = sorted(merged.values(), key=lambda record: record.timestamp)
+        with open(path + ".tmp", "wb") as f:
+            write_dump(f, records)
+        os.replace(path + ".tmp", path)
+        catalog[segment_start] = {
+            "file": path,
+            "count": len(records),
+            "last": records[-1].timestamp.isoformat(),
+            "uploaded": False,
+        }
+        written += 1
+
+    save_segment_catalog(catalog_path, catalog)
+    return written
 
 
 def get_all_attendance_from_device(
-    ip, port=4370, timeout=30, device_id=None, clear_from_device_on_fetch=False
+    ip, port=4370, timeout=30, device_id=None, clear_from_device_on_fetch=False, delta=False
 ):
 
     zk = ZK(ip, port=port, timeout=timeout)
     conn = None
     attendances = []
     try:
-        conn = zk.connect()
+        with timed("connect", device_id):
+            conn = zk.connect()
         x = conn.disable_device()
         # device is disabled when fetching data
         info_logger.info("\t".join((ip, "Device Disable Attempted. Result:", str(x))))
-        attendances = conn.get_attendance()
+        with timed("get_attendance", device_id) as fetched:
+            attendances = conn.get_attendance()
+            fetched["records"] = len(attendances)
         info_logger.info("\t".join((ip, "Attendances Fetched:", str(len(attendances)))))
-        status.set(f"{device_id}_push_timestamp", None)
-        status.set(f"{device_id}_pull_timestamp", str(datetime.datetime.now()))
-        status.save()
-
-        if len(attendances):
-            dump_file_name = get_dump_file_name_and_directory(device_id, ip)
-
-            with open(dump_file_name, "w+") as f:
-                f.write(
-                    json.dumps(
-                        list(map(lambda x: x.__dict__, attendances)),
-                        default=datetime.datetime.timestamp,
-                    )
-                )
+        if delta:
+            serial = conn.get_serialnumber()
+            watermark = make_watermark(serial, attendances)
+            attendances = select_new_attendances(device_id, serial, attendances)
+            info_logger.info("\t".join((ip, "New Attendances Since Watermark:", str(len(attendances)))))
+        with status_lock:
+            status.set(f"{device_id}_push_timestamp", None)
+            status.set(f"{device_id}_pull_timestamp", str(datetime.datetime.now()))
+            if delta:
+                # only becomes the watermark after the dump is uploaded, see commit_watermark
+                status.set(f"{device_id}_pending_watermark", watermark)
+            status.save()
+
+        with timed("dump_write", device_id) as dumped:
+            written = write_segments(device_id, ip, attendances)
+            dumped["records"] = len(attendances)
+        info_logger.info("\t".join((ip, "Segments Written:", str(written))))
         x = conn.enable_device()
         info_logger.info("\t".join((ip, "Device Enable Attempted. Result:", str(x))))
     except:
@@ -87,59 +334,179 @@ def get_all_attendance_from_device(
             conn.disconnect()
     return "success"
 
-def upload_fingerprint_records(devices, url, session):
+def post_with_retry(session, endpoint, max_attempts=5, backoff=2, **kwargs):
+    """Posts to a whitelisted method, retrying with exponential backoff, and returns its message."""
+
+    for attempt in range(max_attempts):
+        try:
+            response = session.post(endpoint, timeout=60, **kwargs)
+            if response.status_code == 200:
+                return response.json().get("message")
+            info_logger.info(f"HTTP Error: {response.status_code} {response.text[:200]}")
+            if response.status_code < 500 and response.status_code != 429:
+                break
+        except requests.RequestException as e:
+            info_logger.info(f"Request to {endpoint} failed: {e}")
+        if attempt < max_attempts - 1:
+            time.sleep(backoff * 2 ** attempt)
+    raise Exception(f"{endpoint} failed after {attempt + 1} attempt(s)")
+
+
+def upload_dump_in_chunks(
+    file_path, file_name, url, session, company, device_id, segment_start=None, chunk_size=256 * 1024
+):
+    """Uploads a dump gzip compressed and split in chunks, each chunk retried on its own.
+
+    The upload id is the hash of the compressed dump, so an interrupted upload of the same
+    dump resumes after the chunks the server already acknowledged.
+    """
+
+    with open(file_path, "rb") as f:
+        # fixed mtime keeps the hash, and so the upload id, stable between runs
+        payload = gzip.compress(f.read(), mtime=0)
+    upload_id = hashlib.sha256(payload).hexdigest()
+    total_chunks = max(1, -(-len(payload) // chunk_size))
+
+    upload_status = post_with_retry(
+        session,
+        f"{url}/api/method/fingerprint.api.upload_dump.get_upload_status",
+        data={
+            "upload_id": upload_id,
+            "file_name": file_name,
+            "company": company,
+            "device_id": device_id,
+            "segment_start": segment_start,
+        },
+    )
+    if upload_status["complete"]:
+        return upload_status["file_url"]
+    received = set(upload_status["received"])
+    if received:
+        info_logger.info(f"Resuming upload of {file_name} after {len(received)}/{total_chunks} chunks")
+
+    result = None
+    for index in range(total_chunks):
+        if index in received:
+            continue
+        result = post_with_retry(
+            session,
+            f"{url}/api/method/fingerprint.api.upload_dump.upload_chunk",
+            data={
+                "upload_id": upload_id,
+                "file_name": file_name,
+                "chunk_index": index,
+                "total_chunks": total_chunks,
+                "company": company,
+                "device_id": device_id,
+                "segment_start": segment_start,
+            },
+            files={
+                "chunk": (
+                    f"{file_name}.{index}",
+                    payload[index * chunk_size:(index + 1) * chunk_size],
+                    "application/octet-stream",
+                )
+            },
+        )
+    if not result or not result["complete"]:
+        raise Exception(f"Upload of {file_name} is incomplete")
+    return result["file_url"]
+
 
+def upload_fingerprint_records(devices, url, session, company):
+    """Uploads the segments written since the last upload, the watermark is committed once all
+    segments of a device are uploaded."""
 
     for device in devices:
         try:
-            # File to upload
-            file_path = (
-                f"logs/{device['id']}_{device['ip'].replace('.','_')}_last_fetch_dump.json"
-            )
-            info_logger.info(file_path)
-            # Upload the file
-            with open(file_path, "rb") as f:
-                files = {
-                    "file": (
-                        f"{device['id']}_{device['ip'].replace('.','_')}_last_fetch_dump.json",
-                        f,
-                        "application/json",
+            catalog_path = get_segment_catalog_path(device["id"], device["ip"])
+            catalog = load_segment_catalog(catalog_path)
+            pending = [segment_start for segment_start, entry in sorted(catalog.items()) if not entry["uploaded"]]
+            if not pending:
+                info_logger.info(f"No new records to upload from {device['ip']}")
+                commit_watermark(device["id"])
+                continue
+            for segment_start in pending:
+                file_path = catalog[segment_start]["file"]
+                info_logger.info(file_path)
+                with timed("upload", device["id"]) as uploaded:
+                    file_url = upload_dump_in_chunks(
+                        file_path,
+                        f"{os.path.basename(file_path)}.gz",
+                        url,
+                        session,
+                        company,
+                        device["id"],
+                        segment_start,
                     )
-                }
-                data = {
-                    "is_private": 1,  # 1 = private, 0 = public
-                    "fieldname": f"attach_{device['id']}_data",  # The field in the doctype that holds the attachment
-                }
-
-                response = session.post(
-                    f"{url}/api/method/upload_file", files=files, data=data
-                )
-
-            # Check result
-            if response.status_code == 200:
-                result = response.json()
-                if result.get("message"):
-                    file_url = result["message"]["file_url"]
-                    
-                    info_logger.info(f"File uploaded successfully: {file_url}")
-                else:
-                    info_logger.info("Upload failed:", result)
-            else:
-                info_logger.info("HTTP Error:", response.status_code, response.text)
-                
-            info_logger.info(f" records uploaded successfully from {device['ip']}")
+                    uploaded["records"] = catalog[segment_start]["count"]
+                catalog[segment_start]["uploaded"] = True
+                save_segment_catalog(catalog_path, catalog)
+                info_logger.info(f"File uploaded successfully: {file_url}")
+            commit_watermark(device["id"])
+            info_logger.info(f"{len(pending)} segment(s) uploaded successfully from {device['ip']}")
             print(f" records uploaded successfully from {device['ip']}")
         except Exception as e:
-            info_logger.info(f"failed to upload records from {device['ip']}")
+            info_logger.info(f"failed to upload records from {device['ip']}: {e}")
             print(Fore.RED + f"failed to upload records from {device['ip']}" + Style.RESET_ALL)
 
 
 
+def pull_devices_concurrently(devices, max_workers=8, retries=1, timeout=30, delta=False):
+    """Pulls every device in its own worker thread and returns {device id: "success" | "failed"}.
+
+    A slow or offline device only holds up its own worker; devices that failed are
+    retried on their own for `retries` more rounds once the first round is done.
+    """
+
+    results = {}
+    pending = list(devices)
+    for attempt in range(retries + 1):
+        if not pending:
+            break
+        if attempt:
+            info_logger.info(f"Retrying {len(pending)} failed device(s), attempt {attempt}")
+            print(Fore.YELLOW + f"Retrying {len(pending)} failed device(s)..." + Style.RESET_ALL)
+
+        with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(pending)))) as executor:
+            futures = {
+                executor.submit(
+                    get_all_attendance_from_device,
+                    device["ip"],
+                    port=4370,
+                    timeout=timeout,
+                    device_id=device["id"],
+                    clear_from_device_on_fetch=False,
+                    delta=delta,
+                ): device
+                for device in pending
+            }
+            for future in as_completed(futures):
+                device = futures[future]
+                try:
+                    res = future.result()
+                except Exception as e:
+                    info_logger.exception(f"Error fetching records from {device['ip']}: {e}")
+                    res = "failed"
+                results[device["id"]] = res
+                if res == "success":
+                    print(f"Records fetched from {device['ip']}")
+                else:
+                    info_logger.info(f"Records fetching failed for {device['ip']}")
+                    print(Fore.RED + f"Records fetching failed for {device['ip']}" + Style.RESET_ALL)
+
+        pending = [device for device in pending if results[device["id"]] != "success"]
+    return results
+
+
 url = "https://moi-mis.gov.sy"
 username = "USERNAME"
 password = "PASSWORD"
 ips = "IPs"
 company = "COMPANY"
+max_workers = 8  # number of devices pulled at the same time
+max_retries = 1  # extra rounds for devices that failed to respond
+delta_pull = False  # only dump punches recorded since the last uploaded pull
 
 # Login to get session cookies
 session = requests.Session()
@@ -156,41 +523,26 @@ devices_ips = ips.split(',')
 number_of_devices = len(devices_ips)
 devices = []
 for device_number, device_ip in enumerate(devices_ips, 1):
-    devices.append({"ip": device_ip, "id": f"{company}_{device_number}"})
-
-
-all_success = True  # Flag to track success
-print(f"IPs: {devices_ips} | Company: {company}")
-for device in devices:
-    try:
-        res = get_all_attendance_from_device(
-            device["ip"],
-            port=4370,
-            timeout=30,
-            device_id=device["id"],
-            clear_from_device_on_fetch=False,
-        )
-        if res == "success":
-            continue
-        else:
-            info_logger.info(f"Records fetching failed for {device['ip']}")
-            print(Fore.RED + f"Records fetching failed for {device['ip']}" + Style.RESET_ALL)
-            all_success = False
-            break  # Optional: stop loop on first failure
-    except Exception as e:
-        info_logger.exception(f"Error fetching records from {device['ip']}: {e}")
-        print(Fore.RED + f"Error fetching records from {device['ip']}" + Style.RESET_ALL)
-        all_success = False
-        break
-
-# Only run upload if all devices succeeded
-if all_success:
-    upload_fingerprint_records(devices, url, session)
-else:
-    print(Fore.YELLOW + "Upload skipped due to device fetch failure." + Style.RESET_ALL)
-
-
-
+    devices.append({"ip": device_ip.strip(), "id": f"{company}_{device_number}"})
 
 
+print(f"Devices: {devices_ips} | Company: {company}")
+run_id = uuid.uuid4().hex[:12]
+run_started = time.time()
+results = pull_devices_concurrently(
+    devices, max_workers=max_workers, retries=max_retries, timeout=30, delta=delta_pull
+)
 
+# Healthy devices are uploaded even when others failed
+fetched_devices = [device for device in devices if results.get(device["id"]) == "success"]
+failed_devices = [device for device in devices if results.get(device["id"]) != "success"]
+if fetched_devices:
+    upload_fingerprint_records(fetched_devices, url, session, company)
+send_run_metrics(url, session, company, run_id, run_started)
+if failed_devices:
+    print(
+        Fore.YELLOW
+        + "Upload skipped for unreachable devices: "
+        + ", ".join(device["ip"] for device in failed_devices)
+        + Style.RESET_ALL
+    )
@@ -1,8 +1,22 @@
 import frappe
 import logging
+from frappe import _
+from frappe.utils import now_datetime
 from logging.handlers import RotatingFileHandler
 from datetime import datetime, time
+from itertools import groupby
+from operator import itemgetter
 from frappe.core.doctype.user.user import timedelta
+from fingerprint.api.cache import get_holiday_dates
+from fingerprint.api.attendance_engine import compute_attendance
+from fingerprint.api.fetch_checkins import get_series_names, update_job_state
+from fingerprint.api.metrics import metrics_context, save_run_summary, span, start_run
+
+ATTENDANCE_PROGRESS_EVENT = "fingerprint_attendance_progress"
+ATTENDANCE_STATE_KEY = "fingerprint_attendance_state_{0}"
+ATTENDANCE_SHIFTS_KEY = "fingerprint_attendance_shifts_{0}"
+SHIFT_LOCK_KEY = "fingerprint_attendance_lock_{0}"
+SHIFT_LOCK_TIMEOUT = 4 * 60 * 60
 
 def setup_logger(name, log_file, level=logging.INFO, formatter=None):
     
@@ -22,60 +36,63 @@ def setup_logger(name, log_file, level=logging.INFO, formatter=None):
 info_logger = setup_logger('info_logger', '/'.join(['logs', 'logs.log']))
 
 
-def add_absence_to_attendances(process_attendance_after, last_sync_of_checkin):
-    
-    # Step 1: Fetch all check-ins
-    checkins = frappe.db.sql("""
-        SELECT employee_name, employee, time, log_type
-        FROM `tabEmployee Checkin`
-        ORDER BY employee ASC, time ASC
-    """, as_dict=True)
-    
-    # Step 1: Build base employee_sessions from logs
-    employee_sessions = {}
-    # all_dates = set()
-
-    for log in checkins:
-        emp = log.employee
-        log_date = log.time.date()
-
-        # all_dates.add(log_date)
+def iter_checkin_batches(start, end, batch_size=100):
+    """Yields the checkins between start and end of `batch_size` employees at a time,
+    ordered by employee and time.
 
-        if emp not in employee_sessions:
-            employee_sessions[emp] = {}
+    Memory depends on the batch and the window, not on the size of the Employee Checkin table.
+    """
+    employees = frappe.db.sql_list("""
+        SELECT DISTINCT employee
+        FROM `tabEmployee Checkin`
+        WHERE time BETWEEN %s AND %s
+        ORDER BY employee ASC
+    """, (start, end))
 
-        if log_date not in employee_sessions[emp]:
-            employee_sessions[emp][log_date] = []
+    for i in range(0, len(employees), batch_size):
+        yield frappe.db.sql("""
+            SELECT employee_name, employee, time, log_type
+            FROM `tabEmployee Checkin`
+            WHERE employee IN %(employees)s AND time BETWEEN %(start)s AND %(end)s
+            ORDER BY employee ASC, time ASC
+        """, {"employees": employees[i:i + batch_size], "start": start, "end": end}, as_dict=True)
 
-        employee_sessions[emp][log_date].append(log)
 
+def add_absence_to_attendances(process_attendance_after, last_sync_of_checkin):
+    
     min_date = datetime.strptime(process_attendance_after, "%Y-%m-%d").date()
     max_date = datetime.strptime(last_sync_of_checkin, "%Y-%m-%d %H:%M:%S").date()
     full_date_range = [min_date + timedelta(days=x) for x in range((max_date - min_date).days + 1)]
+    writer = AttendanceWriter()
+
+    # Step 1: Go through the check-ins of the window a batch of employees at a time
+    for batch in iter_checkin_batches(datetime.combine(min_date, time.min), last_sync_of_checkin):
+        # Step 2: Attendance of every day with logs, computed for the whole batch at once
+        for row in compute_attendance(batch):
+            writer.add(row)
+
+        # Step 3: Days of the window without logs, the batch's employees are loaded with one query
+        employees = {
+            employee.name: employee
+            for employee in frappe.get_all(
+                "Employee",
+                filters={"name": ["in", list({log.employee for log in batch})]},
+                fields=["name", "employee_name", "holiday_list"],
+            )
+        }
+        for employee, checkins in groupby(batch, key=itemgetter("employee")):
+            days_with_logs = {log.time.date() for log in checkins}
+            details = employees.get(employee) or frappe._dict()
+            employee_name = details.employee_name
+            holiday_dates = get_holiday_dates(details.holiday_list)
+            for log_date in full_date_range:
+                if log_date in days_with_logs:
+                    continue
+                # vacation
+                # Check if the date is a holiday in the employee's holiday list
+                is_holiday = log_date in holiday_dates
 
-    # Step 3: Add missing dates to each employee with empty list
-    session = employee_sessions.copy()
-    for emp in employee_sessions:
-        for date in full_date_range:
-            if date not in session[emp]:
-                session[emp][date] = []
-
-    # Step 3: Process logs
-    for employee, daily_logs in session.items():
-        employee_name = frappe.db.get_value("Employee", employee, "employee_name")
-        for log_date, logs in daily_logs.items():
-            sorted_logs = sorted(logs, key=lambda x: 0 if x['log_type'] == 'IN' else 1)
-
-            if len(sorted_logs)==0: # vacation                
-                # Step 1: Get employee's holiday list
-                holiday_list = frappe.db.get_value("Employee", employee, "holiday_list")
-
-                date_str = log_date.strftime("%Y-%m-%d")
-                # Step 2: Check if the date is a holiday in that list
-                result = frappe.db.sql(f"""SELECT name FROM `tabHoliday` WHERE parent = '{holiday_list}' AND holiday_date = '{date_str}' LIMIT 1""")
-                is_holiday = bool(result)
-
-                # save_or_insert({
+                # writer.add({
                 #     "employee": employee,
                 #     "employee_name": employee_name,
                 #     "attendance_date": log_date,
@@ -87,126 +104,214 @@ def add_absence_to_attendances(process_attendance_after, last_sync_of_checkin):
                 #     "status":'Absent',
                 #     "custom_holiday": 1 if is_holiday else 0
                 # })
-            else:
-                calculate_early_exit_and_late_entry(employee, sorted_logs)
+    writer.flush()
 
                     
-def calculate_early_exit_and_late_entry(employee, sorted_logs):
-    checkin_time = None
-    employee_name = frappe.db.get_value("Employee", employee, "employee_name")
-    
-    for log in sorted_logs:
-        if log.log_type == "IN" and checkin_time is None:
-            checkin_time = log.time
-            work_start = datetime.combine(checkin_time.date(), time(8, 30))
-            delay_enter = max((checkin_time - work_start).total_seconds() / 60, 0)
-            save_or_insert({
-                "employee": employee,
-                "employee_name": employee_name,
-                "attendance_date": checkin_time.date(),
-                "in_time": checkin_time.time(),
-                "out_time": None,
-                "working_hours": None,
-                "custom_late_entry_in_minutes": round(delay_enter, 1),
-                "custom_early_exit_in_minutes": None,
-            })
-        elif log.log_type == "OUT":
-            checkout_time = log.time
-            if checkin_time and checkout_time > checkin_time:
-                work_start = datetime.combine(checkin_time.date(), time(8, 30))
-                work_end = datetime.combine(checkin_time.date(), time(15, 0))
-                working_hours = round((checkout_time - checkin_time).total_seconds() / 3600, 2)
-                delay_enter = max((checkin_time - work_start).total_seconds() / 60, 0)
-                early_exit = max((work_end - checkout_time).total_seconds() / 60, 0)
-
-                save_or_insert({
-                    "employee": employee,
-                    "employee_name": employee_name,
-                    "attendance_date": checkin_time.date(),
-                    "in_time": checkin_time.time(),
-                    "out_time": checkout_time.time(),
-                    "working_hours": working_hours,
-                    "custom_late_entry_in_minutes": round(delay_enter, 1),
-                    "custom_early_exit_in_minutes": round(early_exit, 1),
-                })
-                
-                checkin_time = None
-            elif not checkin_time:
-                # No IN before OUT — save only checkout
-                work_end = datetime.combine(checkout_time.date(), time(15, 0))
-                early_exit = max((work_end - checkout_time).total_seconds() / 60, 0)
-                save_or_insert({
-                    "employee": employee,
-                    "employee_name": employee_name,
-                    "attendance_date": checkout_time.date(),
-                    "in_time": None,
-                    "out_time": checkout_time.time(),
-                    "working_hours": None,
-                    "custom_late_entry_in_minutes": None,
-                    "custom_early_exit_in_minutes": round(early_exit, 1),
-                })
-    if checkin_time:
-        # Final unmatched IN
-        work_start = datetime.combine(checkin_time.date(), time(8, 30))
-        delay_enter = max((checkin_time - work_start).total_seconds() / 60, 0)
-        save_or_insert({
-                    "employee": employee,
-            "employee_name": employee_name,
-            "attendance_date": checkin_time.date(),
-            "in_time": checkin_time.time(),
-            "out_time": None,
-            "working_hours": None,
-            "custom_late_entry_in_minutes": round(delay_enter, 1),
-            "custom_early_exit_in_minutes": None,
-        })
-
 def fetch_for_specific_shift_type(shift, process_attendance_after, last_sync_of_checkin):
     doc = frappe.get_doc("Shift Type", shift)
     doc.process_attendance_after = process_attendance_after
     doc.last_sync_of_checkin = last_sync_of_checkin
     doc.process_auto_attendance()
 
-def save_or_insert(data):
-    """Insert or update a time sheet based on employee and date."""
-    existing = frappe.get_all("Attendance",
-        filters={
-            "employee_name": data["employee_name"],
-            "attendance_date": data["attendance_date"]
-        },
-        fields=["name"]
-    )
+class AttendanceWriter:
+    """Collects Attendance rows and upserts them in batches keyed by (employee, attendance_date).
+
+    The first write of a key carries all its fields; later writes to the same key, in memory
+    or already stored, only change in_time, out_time, working_hours and custom_holiday.
+    Each flush looks up the existing Attendance of its keys in one query, inserts the new
+    ones with a multi-row INSERT, named from the Attendance naming series, updates the drafts
+    and commits once. Submitted Attendance
+    can't be changed, its keys are skipped and counted in `submitted`.
+    """
+
+    update_fields = ("in_time", "out_time", "working_hours", "custom_holiday")
+    naming_series = "HR-ATT-.YYYY.-"
+
+    def __init__(self, batch_size=500):
+        self.batch_size = batch_size
+        self.rows = {}
+        self.submitted = 0
+
+    def add(self, data):
+        key = (data["employee"], data["attendance_date"])
+        if key in self.rows:
+            self.rows[key].update({field: data.get(field) for field in self.update_fields})
+        else:
+            self.rows[key] = dict(data)
+            if len(self.rows) >= self.batch_size:
+                self.flush()
+
+    def flush(self):
+        if not self.rows:
+            return
+        rows, self.rows = self.rows, {}
+        with span("attendance_upsert", len(rows)):
+            self.write(rows)
+        with span("commit"):
+            frappe.db.commit()
+
+    def write(self, rows):
+        existing = {
+            (attendance.employee, attendance.attendance_date): attendance
+            for attendance in frappe.db.sql("""
+                SELECT name, employee, attendance_date, docstatus
+                FROM `tabAttendance`
+                WHERE docstatus < 2 AND (employee, attendance_date) IN %(keys)s
+            """, {"keys": tuple(rows)}, as_dict=True)
+        }
+        companies = dict(frappe.db.sql(
+            """SELECT name, company FROM `tabEmployee` WHERE name IN %(employees)s""",
+            {"employees": tuple({employee for employee, attendance_date in rows})},
+        ))
+
+        updates = {}
+        inserts = []
+        submitted = 0
+        user = frappe.session.user
+        now = now_datetime()
+        for key, data in rows.items():
+            data = {field: get_attendance_time(data, field) for field in data}
+            if key in existing and existing[key].docstatus == 1:
+                submitted += 1
+            elif key in existing:
+                updates[existing[key].name] = {field: data.get(field) for field in self.update_fields}
+            else:
+                inserts.append((
+                    user, now, now, user, 0, self.naming_series,
+                    data["employee"], data.get("employee_name"), companies.get(data["employee"]),
+                    data["attendance_date"], data.get("status") or "Present",
+                    data.get("in_time"), data.get("out_time"), data.get("working_hours"),
+                    data.get("custom_late_entry_in_minutes"), data.get("custom_early_exit_in_minutes"),
+                    data.get("custom_holiday") or 0,
+                ))
+
+        if inserts:
+            names = get_series_names("Attendance", len(inserts), self.naming_series)
+            inserts = [(name, *row) for name, row in zip(names, inserts)]
+            frappe.db.bulk_insert("Attendance", [
+                "name", "owner", "creation", "modified", "modified_by", "docstatus", "naming_series",
+                "employee", "employee_name", "company", "attendance_date", "status",
+                "in_time", "out_time", "working_hours",
+                "custom_late_entry_in_minutes", "custom_early_exit_in_minutes", "custom_holiday",
+            ], inserts)
+        if updates:
+            frappe.db.bulk_update("Attendance", updates)
+        if submitted:
+            self.submitted += submitted
+            info_logger.info(f"Skipped {submitted} submitted Attendance, they can't be updated")
+
+
+def get_attendance_time(data, field):
+    """in_time and out_time are Datetime fields, times of day are put on the attendance date."""
+    value = data[field]
+    if field in ("in_time", "out_time") and isinstance(value, time):
+        return datetime.combine(data["attendance_date"], value)
+    return value
 
-    if existing:
-        attendance = frappe.get_doc("Attendance", existing[0].name)
-        attendance.in_time = data.get("in_time")
-        attendance.out_time = data.get("out_time")
-        attendance.working_hours = data.get("working_hours")
-        attendance.custom_holiday = data.get("custom_holiday")
-        # attendance.status = data.get("status")
-        # attendance.delay_enter = data.get("custom_late_entry_in_minutes")
-        # attendance.early_exit = data.get("custom_early_exit_in_minutes")
-        attendance.save(ignore_permissions=True)
-    else:
-        attendance = frappe.get_doc({
-            "doctype": "Attendance",
-            **data
-        })
-        attendance.insert(ignore_permissions=True)
-
-    frappe.db.commit()
-    
 @frappe.whitelist()
 def process_auto_attendance_for_all_shifts(shift_type, process_attendance_after, last_sync_of_checkin):
-    """Called from hooks"""
-    # try:
+    """Queues one background job per shift type and returns the run id to follow them with.
+
+    An empty or unknown shift_type processes every shift type. Shifts already being processed
+    by another run are left out and returned as `locked`. Progress is published as
+    `fingerprint_attendance_progress` realtime events, see get_attendance_status.
+    """
     shift_list = frappe.get_all("Shift Type", pluck="name")
-    if shift_type not in shift_list:
-        for shift in shift_list:
+    shifts = shift_list if shift_type not in shift_list else [shift_type]
+
+    run_id = frappe.generate_hash(length=12)
+    queued, locked = [], []
+    for shift in shifts:
+        (queued if acquire_shift_lock(shift, run_id) else locked).append(shift)
+    if not queued:
+        frappe.throw(_("Attendance of {0} is already being processed").format(", ".join(locked)))
+
+    start_run(run_id)
+    update_job_state(ATTENDANCE_STATE_KEY.format(run_id), shifts=len(queued))
+    for shift in queued:
+        set_shift_status(run_id, shift, "queued")
+        frappe.enqueue(
+            "fingerprint.api.mark_attendance.process_shift_attendance",
+            queue="long",
+            timeout=SHIFT_LOCK_TIMEOUT,
+            run_id=run_id,
+            shift=shift,
+            process_attendance_after=process_attendance_after,
+            last_sync_of_checkin=last_sync_of_checkin,
+        )
+    return {"run_id": run_id, "queued": queued, "locked": locked}
+
+
+def acquire_shift_lock(shift, run_id):
+    """Claims a shift type for a run, False while another run holds it."""
+    cache = frappe.cache()
+    return bool(cache.set(cache.make_key(SHIFT_LOCK_KEY.format(shift)), run_id, nx=True, ex=SHIFT_LOCK_TIMEOUT))
+
+
+def release_shift_lock(shift, run_id):
+    cache = frappe.cache()
+    key = cache.make_key(SHIFT_LOCK_KEY.format(shift))
+    holder = cache.get(key)
+    if holder and holder.decode() == run_id:
+        cache.delete(key)
+
+
+def set_shift_status(run_id, shift, status):
+    frappe.cache().hset(ATTENDANCE_SHIFTS_KEY.format(run_id), shift, status)
+
+
+def process_shift_attendance(run_id, shift, process_attendance_after, last_sync_of_checkin):
+    """Background job processing one shift type of process_auto_attendance_for_all_shifts."""
+    set_shift_status(run_id, shift, "running")
+    publish_attendance_progress(run_id, shift, "running", update_job_state(ATTENDANCE_STATE_KEY.format(run_id)))
+    failed = 0
+    try:
+        # keeps Attendance hooks from reloading shift types and sending messages for every row
+        frappe.flags.fingerprint_bulk_attendance = True
+        with metrics_context(run_id), span("shift_attendance"):
             fetch_for_specific_shift_type(shift, process_attendance_after, last_sync_of_checkin)
-            # add_absence_to_attendances(process_attendance_after, last_sync_of_checkin)
-            
-    else:
-        fetch_for_specific_shift_type(shift_type, process_attendance_after, last_sync_of_checkin)
-        # add_absence_to_attendances(process_attendance_after, last_sync_of_checkin)
-    # except Exception as e:
-    #     frappe.throw(str(e))
+        frappe.db.commit()
+        status = "completed"
+    except Exception:
+        frappe.db.rollback()
+        frappe.log_error(title=f"Fingerprint Attendance Error: {shift}", message=frappe.get_traceback())
+        failed = 1
+        status = "failed"
+    finally:
+        frappe.flags.fingerprint_bulk_attendance = False
+        release_shift_lock(shift, run_id)
+
+    set_shift_status(run_id, shift, status)
+    state = update_job_state(ATTENDANCE_STATE_KEY.format(run_id), finished=1, failed=failed)
+    info_logger.info(f"Attendance of shift {shift} {status} in run {run_id}")
+    publish_attendance_progress(run_id, shift, status, state)
+    if state["finished"] >= state["shifts"]:
+        save_run_summary(run_id, "Attendance")
+        frappe.publish_realtime("list_update", {"doctype": "Attendance"}, user=frappe.session.user)
+
+
+def publish_attendance_progress(run_id, shift, status, state):
+    frappe.publish_realtime(
+        ATTENDANCE_PROGRESS_EVENT,
+        {
+            "run_id": run_id,
+            "shift": shift,
+            "status": status,
+            "percent": int(state.get("finished", 0) / (state.get("shifts") or 1) * 100),
+            "finished": int(state.get("finished", 0)),
+            "failed": int(state.get("failed", 0)),
+            "shifts": int(state.get("shifts", 0)),
+        },
+        user=frappe.session.user,
+    )
+
+
+@frappe.whitelist()
+def get_attendance_status(run_id):
+    """Combined state of a run: shifts, finished and failed counts, and the status of each shift."""
+    state = update_job_state(ATTENDANCE_STATE_KEY.format(run_id))
+    shift_status = frappe.cache().hgetall(ATTENDANCE_SHIFTS_KEY.format(run_id)) or {}
+    state["shift_status"] = {
+        (shift.decode() if isinstance(shift, bytes) else shift): status for shift, status in shift_status.items()
+    }
+    return state
@@ -0,0 +1,224 @@
+"""Timing spans and counters of the collector, import and attendance stages.
+
+Every span adds its seconds, calls and records to totals tagged by company and device, kept in
+a Redis hash shared by all workers and exposed in the Prometheus text format by get_metrics.
+Spans recorded inside metrics_context(run_id) are also added to the run's own totals, which
+save_run_summary stores as a Fingerprint Run once the run is over.
+"""
+import json
+import math
+import time
+from contextlib import contextmanager
+
+import frappe
+from frappe import _
+from frappe.utils import add_to_date, cstr, flt, now_datetime
+
+from fingerprint.api.upload_dump import UPLOAD_ROLES
+
+METRICS_KEY = "fingerprint_metrics"
+RUN_METRICS_KEY = "fingerprint_metrics_run_{0}"
+RUN_METRICS_EXPIRY = 7 * 24 * 60 * 60
+# stages the collector times and sends with record_collector_run
+COLLECTOR_STAGES = ("connect", "get_attendance", "dump_write", "upload")
+STAGE_METRICS = {
+    "seconds": "Seconds spent in the stage.",
+    "calls": "Times the stage ran.",
+    "records": "Records the stage processed.",
+}
+
+
+@contextmanager
+def metrics_context(run_id=None, **tags):
+    """Tags the spans and counters recorded inside it (company, device) and adds them to run_id."""
+    previous = frappe.flags.fingerprint_metrics
+    context = dict(previous or {}, **{tag: value for tag, value in tags.items() if value is not None})
+    if run_id:
+        context["run_id"] = run_id
+    frappe.flags.fingerprint_metrics = context
+    try:
+        yield
+    finally:
+        frappe.flags.fingerprint_metrics = previous
+
+
+@contextmanager
+def span(stage, records=0):
+    """Times the block as a stage. Set `records` on the yielded dict when the count is only
+    known inside the block."""
+    result = frappe._dict(records=records)
+    start = time.perf_counter()
+    try:
+        yield result
+    finally:
+        record_span(stage, time.perf_counter() - start, result.records)
+
+
+def record_span(stage, seconds, records=0, calls=1, **tags):
+    add_metrics({("seconds", stage): seconds, ("calls", stage): calls, ("records", stage): records}, tags)
+
+
+def incr(event, amount=1, **tags):
+    """Adds to the counter of an event, e.g. checkins_inserted."""
+    if amount:
+        add_metrics({("events", event): amount}, tags)
+
+
+def add_metrics(values, tags):
+    context = frappe.flags.fingerprint_metrics or {}
+    company = tags.get("company") or context.get("company") or ""
+    device = tags.get("device") or context.get("device") or ""
+    cache = frappe.cache()
+    keys = [cache.make_key(METRICS_KEY)]
+    if context.get("run_id"):
+        keys.append(cache.make_key(RUN_METRICS_KEY.format(context["run_id"])))
+
+    pipeline = cache.pipeline()
+    for key in keys:
+        for (metric, name), amount in values.items():
+            pipeline.hincrbyfloat(key, "\t".join((metric, name, company, device)), amount)
+    if len(keys) > 1:
+        pipeline.expire(keys[1], RUN_METRICS_EXPIRY)
+    pipeline.execute()
+
+
+def start_run(run_id, started=None):
+    """Marks when a run started, for the duration in its summary."""
+    cache = frappe.cache()
+    key = cache.make_key(RUN_METRICS_KEY.format(run_id))
+    pipeline = cache.pipeline()
+    pipeline.hsetnx(key, "started", started or time.time())
+    pipeline.expire(key, RUN_METRICS_EXPIRY)
+    pipeline.execute()
+
+
+def get_metrics_hash(key):
+    # the values are plain numbers, not pickled like the values of frappe.cache().hset
+    cache = frappe.cache()
+    pipeline = cache.pipeline()
+    pipeline.hgetall(cache.make_key(key))
+    return {field.decode(): float(value) for field, value in pipeline.execute()[0].items()}
+
+
+def get_metric_values(metrics):
+    """[(metric, name, company, device, value)] of a metrics hash."""
+    return sorted((*field.split("\t"), value) for field, value in metrics.items() if field.count("\t") == 3)
+
+
+def save_run_summary(run_id, run_type, company=None):
+    """Stores the totals of a run as a Fingerprint Run, for trends over runs."""
+    key = RUN_METRICS_KEY.format(run_id)
+    metrics = get_metrics_hash(key)
+    started = metrics.get("started")
+    stages, events, devices = {}, {}, {}
+    for metric, name, metric_company, device, value in get_metric_values(metrics):
+        if metric == "events":
+            events[name] = events.get(name, 0) + value
+            continue
+        stage = stages.setdefault(name, {"seconds": 0.0, "calls": 0, "records": 0})
+        stage[metric] += value
+        if device and metric == "seconds":
+            device_stages = devices.setdefault(device, {})
+            device_stages[name] = device_stages.get(name, 0) + value
+
+    finished_on = now_datetime()
+    duration = time.time() - started if started else sum(stage["seconds"] for stage in stages.values())
+    doc = frappe.get_doc(
+        {
+            "doctype": "Fingerprint Run",
+            "run_id": run_id,
+            "run_type": run_type,
+            "company": company,
+            "started_on": add_to_date(finished_on, seconds=-duration),
+            "finished_on": finished_on,
+            "duration": duration,
+            "records": int(max((stage["records"] for stage in stages.values()), default=0)),
+            "summary": json.dumps({"stages": stages, "events": events, "devices": devices}, indent=1),
+        }
+    )
+    doc.insert(ignore_permissions=True, ignore_if_duplicate=True)
+    frappe.cache().delete_value(key)
+    return doc.name
+
+
+def escape_label(value):
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def format_metrics(values):
+    """Prometheus text exposition of [(metric, name, company, device, value)]."""
+    lines = []
+    for metric, help_text in STAGE_METRICS.items():
+        samples = [value for value in values if value[0] == metric]
+        name = f"fingerprint_stage_{metric}_total"
+        lines += [f"# HELP {name} {help_text}", f"# TYPE {name} counter"]
+        lines += [
+            f'{name}{{stage="{escape_label(stage)}",company="{escape_label(company)}",device="{escape_label(device)}"}} {value:g}'
+            for _metric, stage, company, device, value in samples
+        ]
+    lines += ["# HELP fingerprint_events_total Events counted by the import and attendance jobs.",
+              "# TYPE fingerprint_events_total counter"]
+    lines += [
+        f'fingerprint_events_total{{event="{escape_label(event)}",company="{escape_label(company)}",device="{escape_label(device)}"}} {value:g}'
+        for metric, event, company, device, value in values
+        if metric == "events"
+    ]
+    return "\n".join(lines) + "\n"
+
+
+@frappe.whitelist()
+def get_metrics():
+    """Totals of every stage and event since the cache was last cleared, for Prometheus to scrape."""
+    from werkzeug.wrappers import Response
+
+    frappe.only_for("System Manager")
+    return Response(
+        format_metrics(get_metric_values(get_metrics_hash(METRICS_KEY))),
+        content_type="text/plain; version=0.0.4; charset=utf-8",
+    )
+
+
+def parse_collector_metrics(metrics):
+    """[(stage, device, seconds, calls, records)] of a collector's metrics payload, validated as a
+    whole so a bad entry records nothing."""
+    if isinstance(metrics, str):
+        metrics = json.loads(metrics)
+    if not isinstance(metrics, list):
+        frappe.throw(_("Collector metrics must be a list"))
+
+    spans = []
+    for entry in metrics:
+        if not isinstance(entry, list) or len(entry) != 5:
+            frappe.throw(_("Invalid collector metrics entry {0}").format(entry))
+        stage, device, *values = entry
+        if stage not in COLLECTOR_STAGES:
+            frappe.throw(_("Unknown collector stage {0}").format(stage))
+        if not isinstance(device, (str, int)) or len(str(device)) > 140:
+            frappe.throw(_("Invalid collector device {0}").format(device))
+        if not all(isinstance(value, (int, float)) and math.isfinite(value) and value >= 0 for value in values):
+            frappe.throw(_("Invalid collector metrics values {0}").format(values))
+        spans.append((stage, str(device), *values))
+    return spans
+
+
+@frappe.whitelist(methods=["POST"])
+def record_collector_run(company, run_id, metrics, started=None):
+    """Adds the stage timings a collector run sends after its uploads and stores its summary.
+    Only the roles collectors upload dumps with can send them.
+
+    metrics: json list of [stage, device, seconds, calls, records], stage one of COLLECTOR_STAGES
+    """
+    frappe.only_for(UPLOAD_ROLES)
+    run_id = cstr(run_id)
+    if not 0 < len(run_id) <= 64 or not run_id.replace("-", "").replace("_", "").isalnum():
+        frappe.throw(_("Invalid run id: {0}").format(run_id))
+    if not frappe.db.exists("Company", company):
+        frappe.throw(_("Unknown company {0}").format(company))
+    spans = parse_collector_metrics(metrics)
+
+    with metrics_context(run_id, company=company):
+        if started:
+            start_run(run_id, flt(started))
+        for stage, device, seconds, calls, records in spans:
+            record_span(stage, flt(seconds), flt(records), calls=flt(calls), device=device)
+    return save_run_summary(run_id, "Collector", company)
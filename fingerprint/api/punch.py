@@ -0,0 +1,51 @@
+import sys
+
+
+class Punch:
+    """One punch of a device dump, from reading the dump until its Employee Checkin is written.
+
+    Dumps hold millions of punches, so this uses __slots__ instead of the dict each record is
+    parsed into: a slotted object is about a third of the size of a dict with the same keys,
+    and user ids, repeated once per punch, are interned so each one is stored once.
+
+    uid, user_id, timestamp, status and punch are the fields of pyzk's Attendance, timestamp
+    is the raw epoch value until edit_attendance converts it. shift_date, overnight and
+    log_type are set by add_punch_direction.
+    """
+
+    __slots__ = ("uid", "user_id", "timestamp", "status", "punch", "shift_date", "overnight", "log_type")
+
+    def __init__(self, user_id, timestamp, status=0, punch=0, uid=0, shift_date=None, overnight=0, log_type=None):
+        self.uid = uid
+        self.user_id = sys.intern(user_id) if isinstance(user_id, str) else user_id
+        self.timestamp = timestamp
+        self.status = status
+        self.punch = punch
+        self.shift_date = shift_date
+        self.overnight = overnight
+        self.log_type = log_type
+
+    @classmethod
+    def from_dict(cls, record):
+        """json object_hook, builds the punch while the dump is parsed so no dict outlives it."""
+        return cls(
+            record["user_id"],
+            record["timestamp"],
+            record.get("status", 0),
+            record.get("punch", 0),
+            record.get("uid", 0),
+        )
+
+    def copy(self):
+        return Punch(*(getattr(self, field) for field in ("user_id", "timestamp", "status", "punch", "uid", "shift_date", "overnight", "log_type")))
+
+    def as_dict(self):
+        return {field: getattr(self, field) for field in self.__slots__}
+
+    def __eq__(self, other):
+        return isinstance(other, Punch) and all(
+            getattr(self, field) == getattr(other, field) for field in self.__slots__
+        )
+
+    def __repr__(self):
+        return f"Punch({self.user_id!r}, {self.timestamp!r}, log_type={self.log_type!r}, overnight={self.overnight!r})"
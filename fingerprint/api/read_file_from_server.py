@@ -1,24 +1,184 @@
 import frappe
+import codecs
+import gzip
 import os
+import struct
+from collections import deque
 from frappe import _
-from frappe.utils import cstr
+from frappe.utils import cint, cstr
+
+# most bytes one call returns, larger files are read in pages with offset and next_offset
+MAX_READ_BYTES = 4 * 1024 * 1024
+MAX_TAIL_LINES = 10000
+TAIL_BLOCK_SIZE = 64 * 1024
+# roles that can read the app's logs and the uploaded dumps, anyone logged in can read the collector
+RESTRICTED_FILE_ROLES = ("System Manager", "HR Manager")
+
+
+def is_inside(path, directory):
+    return os.path.commonpath([path, directory]) == directory
+
+
+def get_restricted_directories():
+    """Directories only RESTRICTED_FILE_ROLES can read: the app's logs and the directories listed
+    in a site's `fingerprint_readable_directories` site_config."""
+    directories = ["logs", *(frappe.conf.get("fingerprint_readable_directories") or [])]
+    return [os.path.realpath(directory) for directory in directories]
+
+
+def is_dump_file(real_path):
+    """True for the file of a dump registered in Fingerprint Dump. Other private files are left
+    to Frappe's file permissions."""
+    private_files = os.path.realpath(frappe.get_site_path("private", "files"))
+    if not is_inside(real_path, private_files):
+        return False
+    file_url = "/private/files/" + os.path.relpath(real_path, private_files)
+    return bool(frappe.db.exists("Fingerprint Dump", {"file_url": file_url}))
+
+
+def resolve_file_path(file_path):
+    """Real path of file_path, symlinks and `..` resolved, if the user can read it.
+
+    The collector files in the app's api directory, which the Attendance client script packs
+    for download, are readable by anyone logged in. Logs and dumps need RESTRICTED_FILE_ROLES.
+    """
+    real_path = os.path.realpath(file_path)
+    if is_inside(real_path, os.path.realpath(frappe.get_app_path("fingerprint", "api"))):
+        return real_path
+
+    frappe.only_for(RESTRICTED_FILE_ROLES)
+    if is_dump_file(real_path) or any(
+        is_inside(real_path, directory) for directory in get_restricted_directories()
+    ):
+        return real_path
+    frappe.throw(_("Reading {0} is not allowed").format(file_path), frappe.PermissionError)
+
+
+def get_etag(stat):
+    return f'"{stat.st_mtime_ns:x}-{stat.st_size:x}"'
+
+
+def get_content_size(file_path, stat):
+    """Size of the content, for gzip files the decompressed size their trailer records (modulo 4 GiB)."""
+    if not file_path.endswith(".gz") or stat.st_size < 4:
+        return stat.st_size
+    with open(file_path, "rb") as f:
+        f.seek(-4, os.SEEK_END)
+        return struct.unpack("<I", f.read(4))[0]
+
+
+def open_content(file_path):
+    """Binary file object of the content, gzip files are decompressed as they are read."""
+    return gzip.open(file_path, "rb") if file_path.endswith(".gz") else open(file_path, "rb")
+
+
+def read_range(file_path, offset, limit):
+    """(text, next offset, at end) of up to limit bytes from offset. A character cut at the end of
+    the range is left for the next read, so next_offset always falls between characters."""
+    with open_content(file_path) as f:
+        f.seek(offset)
+        data = f.read(limit)
+        at_end = len(data) < limit or not f.read(1)
+    decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+    text = decoder.decode(data, final=at_end)
+    return text, offset + len(data) - len(decoder.getstate()[0]), at_end
+
+
+def read_tail(file_path, lines):
+    """The last lines of a file, read backwards a block at a time (gzip files are streamed through)."""
+    if file_path.endswith(".gz"):
+        with gzip.open(file_path, "rb") as f:
+            return b"".join(deque(f, maxlen=lines)).decode("utf-8", errors="replace")
+
+    with open(file_path, "rb") as f:
+        position = f.seek(0, os.SEEK_END)
+        data = b""
+        # one more newline than lines, unless the file has fewer lines
+        while position and data.count(b"\n") <= lines:
+            size = min(TAIL_BLOCK_SIZE, position)
+            position -= size
+            f.seek(position)
+            data = f.read(size) + data
+    # a trailing newline ends the last line, it doesn't start another one
+    tail = data.splitlines(keepends=True)[-lines:]
+    return b"".join(tail).decode("utf-8", errors="replace")
+
 
 @frappe.whitelist()
-def read_server_file(file_path=None):
+def read_server_file(file_path=None, offset=0, limit=None, tail_lines=None, etag=None, raw=0):
+    """Reads a collector file, a log or a dump, see resolve_file_path.
+
+    params:
+    offset, limit: read limit bytes (at most MAX_READ_BYTES) from offset, continue from the
+        returned next_offset until eof. Offsets are in the decompressed content of gzip files.
+    tail_lines: return the last lines of the file instead, at most MAX_TAIL_LINES
+    etag: etag of an earlier response (or an If-None-Match header); while the file is unchanged
+        and offset is at its end (or tail_lines is given) only {"not_modified": 1} is returned, so
+        a client polling a growing log passes the etag and next_offset of its last read and gets
+        only new bytes. Pages after the first of a long read are returned whatever the etag.
+    raw: send the file itself, with HTTP Range and conditional requests handled
+
+    Returns content, file_name, offset, next_offset, size, eof and etag. An offset past the end of
+    a file that got shorter (a rotated log) reads from the start and returns reset = 1.
+    """
 
     if not file_path:
         frappe.throw(_("File path is required"))
 
-    file_path = cstr(file_path).strip()
+    file_path = resolve_file_path(cstr(file_path).strip())
+    if not os.path.isfile(file_path):
+        frappe.throw(_("File not found: {0}").format(file_path))
 
+    stat = os.stat(file_path)
+    current_etag = get_etag(stat)
+    file_name = os.path.basename(file_path)
 
-    if not os.path.exists(file_path):
-        frappe.throw(_("File not found: {0}").format(file_path))
+    if cint(raw):
+        from werkzeug.utils import send_file
+
+        return send_file(
+            file_path,
+            frappe.request.environ,
+            as_attachment=True,
+            download_name=file_name,
+            etag=current_etag.strip('"'),
+            last_modified=stat.st_mtime,
+            conditional=True,
+        )
 
     try:
-        with open(file_path, "r", encoding="utf-8") as f:
-            content = f.read()
-        return {"content": content, "file_name": os.path.basename(file_path)}
+        size = get_content_size(file_path, stat)
+        if current_etag == (etag or frappe.get_request_header("If-None-Match")) and (
+            tail_lines is not None or cint(offset) >= size
+        ):
+            return {"not_modified": 1, "etag": current_etag, "file_name": file_name}
+
+        if tail_lines is not None:
+            content = read_tail(file_path, max(1, min(cint(tail_lines), MAX_TAIL_LINES)))
+            return {
+                "content": content,
+                "file_name": file_name,
+                "next_offset": size,
+                "size": size,
+                "eof": 1,
+                "etag": current_etag,
+            }
+
+        offset = max(0, cint(offset))
+        limit = min(cint(limit) or MAX_READ_BYTES, MAX_READ_BYTES)
+        reset = 0
+        if offset > size:
+            offset, reset = 0, 1
+        content, next_offset, at_end = read_range(file_path, offset, limit)
+        return {
+            "content": content,
+            "file_name": file_name,
+            "offset": offset,
+            "next_offset": next_offset,
+            "size": size,
+            "eof": int(at_end),
+            "reset": reset,
+            "etag": current_etag,
+        }
     except Exception as e:
         frappe.throw(_("Error reading file: {0}").format(str(e)))
-        
\ No newline at end of file
@@ -0,0 +1,173 @@
+import frappe
+import gzip
+import hashlib
+import os
+import shutil
+from frappe import _
+from frappe.utils import cint, cstr
+from fingerprint.api.dump_format import HEADER, get_dump_size
+from fingerprint.fingerprint.doctype.fingerprint_dump.fingerprint_dump import register_dump
+
+# Chunks of an upload are kept here until every one of them has arrived
+CHUNKS_DIRECTORY = "fingerprint_chunks"
+# roles of the users collectors upload with
+UPLOAD_ROLES = ("System Manager", "HR Manager")
+# largest binary dump stored once decompressed, about 60 million records
+MAX_DUMP_SIZE = 1024 * 1024 * 1024
+DECOMPRESS_BLOCK_SIZE = 1024 * 1024
+
+
+def get_files_path():
+    return os.path.abspath(frappe.get_site_path("private", "files"))
+
+
+def get_chunks_path(upload_id):
+    return os.path.join(get_files_path(), CHUNKS_DIRECTORY, upload_id)
+
+
+def get_dump_file_name(file_name, content_hash):
+    """Name of the reassembled dump, the hash prefix keeps every upload of a device apart
+    while the rest stays the collector's name.
+
+    Binary dumps (`.bin.gz`) are stored decompressed, so the importer can memory map them."""
+    if file_name.endswith(".bin.gz"):
+        file_name = file_name[:-len(".gz")]
+    return f"{content_hash[:10]}_{file_name}"
+
+
+def validate_upload(upload_id, file_name):
+    upload_id = cstr(upload_id).strip()
+    file_name = cstr(file_name).strip()
+    if len(upload_id) != 64 or not all(c in "0123456789abcdef" for c in upload_id):
+        frappe.throw(_("Invalid upload id: {0}").format(upload_id))
+    if not file_name or os.path.basename(file_name) != file_name or file_name.startswith("."):
+        frappe.throw(_("Invalid file name: {0}").format(file_name))
+    return upload_id, file_name
+
+
+def get_received_chunks(upload_id):
+    chunks_path = get_chunks_path(upload_id)
+    if not os.path.isdir(chunks_path):
+        return []
+    return sorted(
+        int(name.split(".")[0]) for name in os.listdir(chunks_path) if name.endswith(".part")
+    )
+
+
+def decompress_dump(compressed_path, dump_path):
+    """Decompresses a gzip compressed binary dump, stopping as soon as it grows past the size
+    its header gives or past MAX_DUMP_SIZE, so a crafted upload can't fill the disk.
+
+    Raises ValueError when the dump is not a binary dump or not the size its header gives.
+    """
+    with gzip.open(compressed_path, "rb") as compressed, open(dump_path, "wb") as dump:
+        header = compressed.read(HEADER.size)
+        expected_size = get_dump_size(header)
+        if expected_size > MAX_DUMP_SIZE:
+            raise ValueError(f"dump of {expected_size} bytes is larger than {MAX_DUMP_SIZE}")
+        dump.write(header)
+        remaining = expected_size - len(header)
+        # one byte more than expected is enough to tell the dump is too long
+        while data := compressed.read(min(DECOMPRESS_BLOCK_SIZE, remaining + 1)):
+            remaining -= len(data)
+            if remaining < 0:
+                raise ValueError("dump is longer than its header gives")
+            dump.write(data)
+    if remaining:
+        raise ValueError("dump is shorter than its header gives")
+
+
+def assemble_chunks(upload_id, file_name, total_chunks):
+    """Joins the chunks into the final dump once all of them are there and checks the hash.
+
+    Returns the file url of the dump, or None while chunks are still missing.
+    """
+    chunks_path = get_chunks_path(upload_id)
+    if len(get_received_chunks(upload_id)) < total_chunks:
+        return None
+
+    dump_file_name = get_dump_file_name(file_name, upload_id)
+    dump_path = os.path.join(get_files_path(), dump_file_name)
+    tmp_path = dump_path + ".tmp"
+    sha = hashlib.sha256()
+    with open(tmp_path, "wb") as dump:
+        for index in range(total_chunks):
+            with open(os.path.join(chunks_path, f"{index:06d}.part"), "rb") as chunk:
+                data = chunk.read()
+            sha.update(data)
+            dump.write(data)
+
+    if sha.hexdigest() != upload_id:
+        # a corrupted chunk can't be told apart from the others, start the upload over
+        os.remove(tmp_path)
+        shutil.rmtree(chunks_path, ignore_errors=True)
+        frappe.throw(_("Uploaded dump {0} does not match its hash, upload it again").format(file_name))
+
+    if file_name.endswith(".gz") and not dump_file_name.endswith(".gz"):
+        try:
+            decompress_dump(tmp_path, tmp_path + ".bin")
+        except (OSError, EOFError, ValueError) as e:
+            for path in (tmp_path, tmp_path + ".bin"):
+                if os.path.exists(path):
+                    os.remove(path)
+            shutil.rmtree(chunks_path, ignore_errors=True)
+            frappe.throw(_("Uploaded dump {0} can't be decompressed: {1}").format(file_name, str(e)))
+        os.replace(tmp_path + ".bin", tmp_path)
+
+    os.replace(tmp_path, dump_path)
+    shutil.rmtree(chunks_path, ignore_errors=True)
+    return f"/private/files/{dump_file_name}"
+
+
+@frappe.whitelist()
+def get_upload_status(upload_id, file_name, company=None, device_id=None, segment_start=None):
+    """Tells the collector which chunks of an upload were already acknowledged."""
+    frappe.only_for(UPLOAD_ROLES)
+    upload_id, file_name = validate_upload(upload_id, file_name)
+
+    dump_file_name = get_dump_file_name(file_name, upload_id)
+    if os.path.exists(os.path.join(get_files_path(), dump_file_name)):
+        file_url = f"/private/files/{dump_file_name}"
+        if company:
+            # in case registering failed when the last chunk arrived
+            register_dump(file_url, company, device_id, upload_id, segment_start)
+        return {"complete": 1, "received": [], "file_url": file_url}
+
+    return {"complete": 0, "received": get_received_chunks(upload_id), "file_url": None}
+
+
+@frappe.whitelist()
+def upload_chunk(upload_id, file_name, chunk_index, total_chunks, company=None, device_id=None, segment_start=None):
+    """Stores one chunk of a gzip compressed dump and reassembles the dump after the last one.
+
+    params:
+    upload_id: sha256 of the whole compressed dump
+    file_name: name of the dump on the collector, e.g. `<device id>_<ip>_<segment start>_dump_segment.bin.gz`
+    chunk_index: position of the chunk sent in the `chunk` file field
+    total_chunks: number of chunks of the dump
+    company, device_id: recorded with the reassembled dump in the Fingerprint Dump manifest
+    segment_start: Monday of the shift week the dump is the segment of, see register_dump
+    """
+    frappe.only_for(UPLOAD_ROLES)
+    upload_id, file_name = validate_upload(upload_id, file_name)
+    chunk_index = cint(chunk_index)
+    total_chunks = cint(total_chunks)
+    if total_chunks < 1 or not 0 <= chunk_index < total_chunks:
+        frappe.throw(_("Invalid chunk {0} of {1}").format(chunk_index, total_chunks))
+
+    chunk = frappe.request.files.get("chunk") if frappe.request else None
+    if not chunk:
+        frappe.throw(_("Chunk content is required"))
+
+    chunks_path = get_chunks_path(upload_id)
+    os.makedirs(chunks_path, exist_ok=True)
+    chunk_path = os.path.join(chunks_path, f"{chunk_index:06d}.part")
+    with open(chunk_path + ".tmp", "wb") as f:
+        f.write(chunk.stream.read())
+    # a chunk is only acknowledged once it is completely on disk
+    os.replace(chunk_path + ".tmp", chunk_path)
+
+    file_url = assemble_chunks(upload_id, file_name, total_chunks)
+    if file_url and company:
+        register_dump(file_url, company, device_id, upload_id, segment_start)
+    return {"complete": cint(bool(file_url)), "received": chunk_index, "file_url": file_url}
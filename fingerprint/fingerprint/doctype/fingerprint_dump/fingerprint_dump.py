@@ -0,0 +1,103 @@
+# Copyright (c) 2026, Mahmod Aldahol and contributors
+# For license information, please see license.txt
+
+import os
+
+import frappe
+from frappe.model.document import Document
+from frappe.utils import now_datetime
+
+
+class FingerprintDump(Document):
+	def get_file_path(self):
+		return os.path.abspath(frappe.get_site_path(self.file_url.strip("/")))
+
+	def on_trash(self):
+		from fingerprint.fingerprint.doctype.fingerprint_import_checkpoint.fingerprint_import_checkpoint import (
+			delete_dump_checkpoints,
+		)
+
+		delete_dump_checkpoints(self.name)
+
+
+def on_doctype_update():
+	# the importer looks up a company's dumps overlapping an import window
+	frappe.db.add_index("Fingerprint Dump", ["company", "to_time", "from_time"])
+	frappe.db.add_index("Fingerprint Dump", ["device_id", "segment_start"])
+
+
+def register_dump(file_url, company, device_id, content_hash, segment_start=None):
+	"""Adds an uploaded dump to the manifest, reading its time range and record count once.
+
+	Uploading the same dump again returns the existing entry. A segment (the dump of one shift
+	week of a device) supersedes the earlier uploads of the same week, see supersede_segments.
+	"""
+	from fingerprint.api.fetch_checkins import get_dump_summary, to_local_datetime
+
+	existing = frappe.db.get_value("Fingerprint Dump", {"content_hash": content_hash})
+	if existing:
+		return existing
+
+	file_path = os.path.abspath(frappe.get_site_path(file_url.strip("/")))
+	record_count, first, last = get_dump_summary(file_path)
+
+	doc = frappe.get_doc(
+		{
+			"doctype": "Fingerprint Dump",
+			"company": company,
+			"device_id": device_id,
+			"segment_start": segment_start or None,
+			"file_url": file_url,
+			"content_hash": content_hash,
+			"record_count": record_count,
+			"from_time": to_local_datetime(first) if record_count else None,
+			"to_time": to_local_datetime(last) if record_count else None,
+			"status": "Pending",
+		}
+	)
+	doc.insert(ignore_permissions=True)
+	if doc.segment_start:
+		supersede_segments(doc)
+	return doc.name
+
+
+def supersede_segments(doc):
+	"""The collector only adds records to a segment, so its earlier uploads are contained in the
+	new one and are no longer imported. Uploads with more records are left alone."""
+	for name in frappe.get_all(
+		"Fingerprint Dump",
+		filters={
+			"company": doc.company,
+			"device_id": doc.device_id,
+			"segment_start": doc.segment_start,
+			"name": ["!=", doc.name],
+			"status": ["!=", "Superseded"],
+			"record_count": ["<=", doc.record_count],
+		},
+		pluck="name",
+	):
+		set_dump_status(name, "Superseded")
+
+
+def set_dump_status(name, status, error=None, import_id=None):
+	values = {"status": status, "error": error}
+	if import_id:
+		values["import_id"] = import_id
+	if status == "Processed":
+		values["processed_on"] = now_datetime()
+	frappe.db.set_value("Fingerprint Dump", name, values, update_modified=False)
+
+
+def register_uploaded_file(doc, method=None):
+	"""File after_insert hook, registers dumps uploaded with upload_file by older collectors.
+
+	Their names are `<company>_<device number>_<ip>_last_fetch_dump.json`.
+	"""
+	if not doc.is_private or not (doc.file_name or "").endswith("_last_fetch_dump.json"):
+		return
+
+	device_id = doc.file_name.rsplit("_", 7)[0]
+	company = device_id.rsplit("_", 1)[0]
+	if not frappe.db.exists("Company", company):
+		return
+	register_dump(doc.file_url, company, device_id, doc.content_hash)
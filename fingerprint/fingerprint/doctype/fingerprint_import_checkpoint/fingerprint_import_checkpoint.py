@@ -0,0 +1,72 @@
+# Copyright (c) 2026, Mahmod Aldahol and contributors
+# For license information, please see license.txt
+
+import hashlib
+
+import frappe
+from frappe.model.document import Document
+from frappe.utils import now_datetime
+
+DOCTYPE = "Fingerprint Import Checkpoint"
+
+
+class FingerprintImportCheckpoint(Document):
+	def autoname(self):
+		self.name = get_checkpoint_name(self.dump, self.import_start_date, self.import_end_date)
+
+
+def get_checkpoint_name(dump, import_start_date, import_end_date):
+	"""One checkpoint per dump and import window, the shards of a window are always the same."""
+	return hashlib.sha1(f"{dump}|{import_start_date}|{import_end_date}".encode()).hexdigest()[:16]
+
+
+def open_checkpoint(dump, import_start_date, import_end_date, total):
+	"""Returns the checkpoint to import a window of a dump with.
+
+	An import of the window that stopped halfway is resumed after its `last_offset`. Any other
+	import starts over from a fresh checkpoint, already stored checkins are skipped then.
+	"""
+	name = get_checkpoint_name(dump, import_start_date, import_end_date)
+	checkpoint = frappe.db.get_value(
+		DOCTYPE, name, ["name", "status", "total", "last_offset", "inserted", "errors"], as_dict=True
+	)
+	# total changes only if the window no longer holds the same records
+	if checkpoint and checkpoint.status == "In Progress" and checkpoint.total == total:
+		return checkpoint
+
+	values = {"status": "In Progress", "total": total, "last_offset": 0, "inserted": 0, "errors": 0, "last_committed_on": None}
+	if checkpoint:
+		frappe.db.set_value(DOCTYPE, name, values, update_modified=False)
+	else:
+		frappe.get_doc(
+			{
+				"doctype": DOCTYPE,
+				"dump": dump,
+				"import_start_date": import_start_date,
+				"import_end_date": import_end_date,
+				**values,
+			}
+		).insert(ignore_permissions=True)
+	frappe.db.commit()
+	return frappe._dict(name=name, **values)
+
+
+def save_checkpoint(name, last_offset, inserted, errors, status="In Progress"):
+	"""Records the progress of an import. Not committed here: it is written right before a batch
+	is committed, so the batch and its checkpoint are committed together or not at all."""
+	frappe.db.set_value(
+		DOCTYPE,
+		name,
+		{
+			"status": status,
+			"last_offset": last_offset,
+			"inserted": inserted,
+			"errors": errors,
+			"last_committed_on": now_datetime(),
+		},
+		update_modified=False,
+	)
+
+
+def delete_dump_checkpoints(dump):
+	frappe.db.delete(DOCTYPE, {"dump": dump})
@@ -0,0 +1,14 @@
+# Copyright (c) 2026, Mahmod Aldahol and contributors
+# For license information, please see license.txt
+
+import frappe
+from frappe.model.document import Document
+
+
+class FingerprintRun(Document):
+	pass
+
+
+def on_doctype_update():
+	# trends are read per run type over time
+	frappe.db.add_index("Fingerprint Run", ["run_type", "finished_on"])
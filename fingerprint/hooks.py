@@ -137,13 +137,23 @@ app_license = "mit"
 # ---------------
 # Hook on document methods and events
 
-# doc_events = {
-# 	"*": {
-# 		"on_update": "method",
-# 		"on_cancel": "method",
-# 		"on_trash": "method"
-# 	}
-# }
+doc_events = {
+	"Employee": {
+		"on_update": "fingerprint.api.cache.clear_employee_cache",
+		"on_trash": "fingerprint.api.cache.clear_employee_cache",
+	},
+	"Holiday List": {
+		"on_update": "fingerprint.api.cache.clear_holiday_cache",
+		"on_trash": "fingerprint.api.cache.clear_holiday_cache",
+	},
+	"Shift Type": {
+		"on_update": "fingerprint.api.cache.clear_shift_timing_cache",
+		"on_trash": "fingerprint.api.cache.clear_shift_timing_cache",
+	},
+	"File": {
+		"after_insert": "fingerprint.fingerprint.doctype.fingerprint_dump.fingerprint_dump.register_uploaded_file",
+	},
+}
 
 # Scheduled Tasks
 # ---------------
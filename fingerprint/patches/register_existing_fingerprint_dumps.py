@@ -0,0 +1,17 @@
+import frappe
+
+from fingerprint.fingerprint.doctype.fingerprint_dump.fingerprint_dump import register_uploaded_file
+
+
+def execute():
+	"""Adds the dumps uploaded before the Fingerprint Dump manifest existed."""
+	files = frappe.get_all(
+		"File",
+		filters={"is_private": 1, "file_name": ["like", "%_last_fetch_dump.json"]},
+		fields=["name", "is_private", "file_name", "file_url", "content_hash"],
+	)
+	for file in files:
+		try:
+			register_uploaded_file(file)
+		except Exception:
+			frappe.log_error(title="Fingerprint Dump Registration Error", message=frappe.get_traceback())